@@ -274,7 +274,7 @@ in
       unitConfig.ConditionPathExists = "/dev/tpm0";
       serviceConfig = {
         Type = "oneshot";
-        ExecStart = "${pkgs.lib.getExe measuredBoot.report-measured-boot-state}";
+        ExecStart = "${pkgs.lib.getExe measuredBoot.measured-boot} report";
         Restart = "on-failure";
         RestartSec = "10s";
       };
@@ -11,6 +11,7 @@ let
   measuredBootPolicy = pkgs.callPackage ../../packages/keylime-measured-boot-policy {
     inherit keylime;
   };
+  measuredBootLibrary = pkgs.callPackage ../../packages/measured-boot-library { };
 
   # Keylime's config.getlist() uses ast.literal_eval and expects Python list
   # literals (e.g. '["value"]') for certain options.
@@ -493,6 +494,7 @@ rec {
 
   # Auto-enroll daemon — same script used by system-manager and NixOS.
   autoEnrollScript = pkgs.writers.writePython3 "keylime-auto-enroll" {
+    libraries = [ measuredBootLibrary ];
     flakeIgnore = [
       "E501"
       "E266"
@@ -17,12 +17,19 @@ Environment variables:
     KEYLIME_TLS_DIR         Directory containing mTLS certs
     KEYLIME_POLL_INTERVAL   Seconds between polls (default: 10)
     KEYLIME_ENROLL_PORT     HTTPS port for report endpoint (default: 8893)
+    KEYLIME_SIGNATURE_SETS_DIR
+                            Store for the Secure Boot signature lists of
+                            compact reports (default:
+                            /var/lib/keylime/signature-sets)
     KEYLIME_LOG_LEVEL       DEBUG, INFO, WARNING, ERROR (default: INFO)
 """
 
+import collections
+import errno
 import json
 import logging
 import os
+import re
 import signal
 import ssl
 import subprocess
@@ -35,6 +42,15 @@ import urllib.error
 from http.server import HTTPServer, BaseHTTPRequestHandler
 from pathlib import Path
 
+from measured_boot_state import (
+    SIGNATURE_SET_DIR,
+    SignatureSetStore,
+    compact_refstate,
+    expand_refstate,
+    missing_signature_sets,
+    signature_set_digest,
+)
+
 LOG_LEVEL = os.environ.get("KEYLIME_LOG_LEVEL", "INFO").upper()
 
 logging.basicConfig(
@@ -60,6 +76,44 @@ CLIENT_CERT = os.path.join(TLS_DIR, "client-cert.pem")
 CLIENT_KEY = os.path.join(TLS_DIR, "client-key.pem")
 AGENT_CERTS_DIR = os.path.join(TLS_DIR, "agent-certs")
 
+# Reports arrive unauthenticated, so everything they can make
+# the daemon keep is bounded.  The limits leave ample room for
+# real Secure Boot databases (a current dbx has a few hundred
+# entries, certificates are a few KiB).
+MAX_REPORT_BYTES = 8 * 1024 * 1024
+MAX_SIGNATURE_SET_ENTRIES = 8192
+MAX_SIGNATURE_DATA_CHARS = 16384
+MAX_STORED_SIGNATURE_SETS = 1024
+
+SECURE_BOOT_KEYS = ("pk", "kek", "db", "dbx")
+REQUIRED_REFSTATE_KEYS = ("scrtm_and_bios", *SECURE_BOOT_KEYS, "uki_digest")
+
+
+class BoundedSignatureSetStore(SignatureSetStore):
+    """SignatureSetStore that refuses new sets once full."""
+
+    def __setitem__(self, digest, sigs):
+        if digest not in self and len(self) >= MAX_STORED_SIGNATURE_SETS:
+            raise OSError(errno.ENOSPC, "signature set store is full")
+        super().__setitem__(digest, sigs)
+
+    def evict(self, keep: set[str]) -> None:
+        """Delete every set whose digest is not in *keep*."""
+        for digest in list(self):
+            if digest not in keep:
+                try:
+                    del self[digest]
+                except KeyError:
+                    pass
+
+
+# Reports are kept in compact form: the pk/kek/db/dbx lists,
+# which nearly every agent shares, are stored once here and
+# referenced by hash.
+signature_sets = BoundedSignatureSetStore(
+    os.environ.get("KEYLIME_SIGNATURE_SETS_DIR", SIGNATURE_SET_DIR),
+)
+
 
 def make_mtls_context() -> ssl.SSLContext:
     """Create an SSL context with client certificate for mTLS."""
@@ -101,11 +155,92 @@ def api_post(url: str, body: dict) -> dict:
         return json.loads(resp.read())
 
 
-# Stores {uuid: {"measured_boot_state": dict}}
+# Stores {uuid: {"measured_boot_state": dict}}, with the
+# refstate in compact form (see signature_sets).
 agent_reports: dict[str, dict] = {}
 agent_reports_lock = threading.Lock()
 
 
+def store_signature_sets(sets: dict[str, list], keep: set[str]) -> bool:
+    """Store *sets*; False if they do not fit.
+
+    A set is only needed until the agents whose reports refer
+    to it are enrolled, so once the store is full the sets no
+    pending report (nor *keep*) refers to are evicted.  If that
+    does not make room, for instance because a flood of bogus
+    reports refers to every stored set, the caller keeps the
+    report's full refstate instead.
+    """
+    new = [d for d in sets if d not in signature_sets]
+    if len(signature_sets) + len(new) > MAX_STORED_SIGNATURE_SETS:
+        with agent_reports_lock:
+            for report in agent_reports.values():
+                keep = keep | set(missing_signature_sets(
+                    report["measured_boot_state"], {},
+                ))
+        signature_sets.evict(keep)
+    try:
+        for digest, sigs in sets.items():
+            signature_sets[digest] = sigs
+    except OSError as e:
+        log.warning("Cannot store signature sets: %s", e)
+        return False
+    return True
+
+
+def _valid_signature(sig: object) -> bool:
+    if not isinstance(sig, dict):
+        return False
+    owner = sig.get("SignatureOwner")
+    data = sig.get("SignatureData")
+    if not isinstance(owner, str) or not isinstance(data, str):
+        return False
+    return len(owner) <= 64 and len(data) <= MAX_SIGNATURE_DATA_CHARS
+
+
+def _valid_signature_list(sigs: object) -> bool:
+    if not isinstance(sigs, list):
+        return False
+    if len(sigs) > MAX_SIGNATURE_SET_ENTRIES:
+        return False
+    return all(_valid_signature(s) for s in sigs)
+
+
+def _valid_signature_set_ref(ref: object) -> bool:
+    if not isinstance(ref, dict) or set(ref) != {"signature_set", "count"}:
+        return False
+    digest, count = ref["signature_set"], ref["count"]
+    if not isinstance(digest, str) or not isinstance(count, int):
+        return False
+    if not re.fullmatch(r"[0-9a-f]{64}", digest):
+        return False
+    return 0 < count <= MAX_SIGNATURE_SET_ENTRIES
+
+
+def _validate_refstate(state: object, compact: bool) -> str | None:
+    """Check the refstate schema; signature lists may be set
+    references if *compact*."""
+    if not isinstance(state, dict):
+        return "is not an object"
+    for key in REQUIRED_REFSTATE_KEYS:
+        if key not in state:
+            return f"lacks {key!r}"
+    bios = state["scrtm_and_bios"]
+    if not isinstance(bios, list) or not all(
+        isinstance(b, dict) for b in bios
+    ):
+        return "has invalid 'scrtm_and_bios'"
+    if not isinstance(state["uki_digest"], dict):
+        return "has invalid 'uki_digest'"
+    for key in SECURE_BOOT_KEYS:
+        value = state[key]
+        if compact and _valid_signature_set_ref(value):
+            continue
+        if not _valid_signature_list(value):
+            return f"has invalid {key!r}"
+    return None
+
+
 def validate_report(report: dict) -> str | None:
     """Validate format of a measured boot report from an agent.
 
@@ -116,6 +251,18 @@ def validate_report(report: dict) -> str | None:
             "measured_boot_state": { ... }
         }
 
+    or, with the Secure Boot signature lists sent by
+    reference (see ``compact_refstate``)::
+
+        {
+            "uuid": "<agent-uuid>",
+            "measured_boot_state_compact": { ... },
+            "signature_sets": {"<sha256>": [ ... ], ...}
+        }
+
+    ``signature_sets`` is optional and only needs to carry
+    the sets the server asked for.
+
     Returns an error message string, or None if valid.
     """
     if not isinstance(report, dict):
@@ -125,9 +272,24 @@ def validate_report(report: dict) -> str | None:
     if not uuid or not isinstance(uuid, str):
         return "missing or invalid 'uuid'"
 
-    measured_boot_state = report.get("measured_boot_state")
-    if not isinstance(measured_boot_state, dict) or not measured_boot_state:
-        return "missing or invalid 'measured_boot_state'"
+    if "measured_boot_state_compact" in report:
+        error = _validate_refstate(
+            report["measured_boot_state_compact"], compact=True,
+        )
+        if error:
+            return f"'measured_boot_state_compact' {error}"
+        sets = report.get("signature_sets", {})
+        if not isinstance(sets, dict) or len(sets) > len(SECURE_BOOT_KEYS):
+            return "invalid 'signature_sets'"
+        if not all(_valid_signature_list(v) for v in sets.values()):
+            return "invalid 'signature_sets'"
+        return None
+
+    if "measured_boot_state" not in report:
+        return "missing 'measured_boot_state'"
+    error = _validate_refstate(report["measured_boot_state"], compact=False)
+    if error:
+        return f"'measured_boot_state' {error}"
 
     return None
 
@@ -248,7 +410,14 @@ class EnrollHandler(BaseHTTPRequestHandler):
             self.send_error(404)
             return
 
-        content_length = int(self.headers.get("Content-Length", 0))
+        try:
+            content_length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            self.send_error(400, "Invalid Content-Length")
+            return
+        if not 0 <= content_length <= MAX_REPORT_BYTES:
+            self.send_error(413, "report too large")
+            return
         try:
             body = json.loads(self.rfile.read(content_length))
         except (json.JSONDecodeError, UnicodeDecodeError):
@@ -262,22 +431,80 @@ class EnrollHandler(BaseHTTPRequestHandler):
             return
 
         uuid = body["uuid"]
+        if "measured_boot_state_compact" in body:
+            measured_boot_state = body["measured_boot_state_compact"]
+            # Only keep the sets this refstate refers to and the
+            # store lacks; anything else in the report is dropped.
+            referenced = set(missing_signature_sets(measured_boot_state, {}))
+            provided = {
+                digest: sigs
+                for digest, sigs in body.get("signature_sets", {}).items()
+                if digest in referenced and digest not in signature_sets
+            }
+            for digest, sigs in provided.items():
+                if signature_set_digest(sigs) != digest:
+                    log.warning(
+                        "Rejected report from %s: signature set"
+                        " does not match digest %s", uuid, digest,
+                    )
+                    self.send_error(400, "signature set does not match digest")
+                    return
+            stored = store_signature_sets(provided, referenced)
+            missing = [
+                digest for digest in missing_signature_sets(
+                    measured_boot_state, signature_sets,
+                )
+                if digest not in provided
+            ]
+            if missing:
+                log.info(
+                    "Requesting %d signature set(s) from %s",
+                    len(missing), uuid,
+                )
+                self._send_json({
+                    "status": "need_signature_sets",
+                    "missing": missing,
+                })
+                return
+            if not stored:
+                log.warning("Keeping full refstate for %s", uuid)
+                measured_boot_state = expand_refstate(
+                    measured_boot_state,
+                    collections.ChainMap(provided, signature_sets),
+                )
+        else:
+            measured_boot_state = body["measured_boot_state"]
+            sets = {}
+            for key in SECURE_BOOT_KEYS:
+                sigs = measured_boot_state[key]
+                if sigs:
+                    sets[signature_set_digest(sigs)] = sigs
+            if store_signature_sets(sets, set(sets)):
+                measured_boot_state = compact_refstate(
+                    measured_boot_state, signature_sets,
+                )
+            else:
+                log.warning("Keeping full refstate for %s", uuid)
+
         with agent_reports_lock:
             agent_reports[uuid] = {
-                "measured_boot_state": body["measured_boot_state"],
+                "measured_boot_state": measured_boot_state,
             }
 
         log.info(
             "Accepted measured boot report from %s"
             " (refstate keys: %s)",
             uuid,
-            ", ".join(sorted(body["measured_boot_state"].keys())),
+            ", ".join(sorted(measured_boot_state.keys())),
         )
 
+        self._send_json({"status": "accepted"})
+
+    def _send_json(self, reply: dict) -> None:
         self.send_response(200)
         self.send_header("Content-Type", "application/json")
         self.end_headers()
-        self.wfile.write(json.dumps({"status": "accepted"}).encode())
+        self.wfile.write(json.dumps(reply).encode())
 
 
 def start_https_server() -> HTTPServer:
@@ -332,7 +559,17 @@ def enroll_agent(uuid: str, report: dict) -> bool:
     event log replay since systemd-pcrphase adds runtime
     extensions, but the PCR value is still quoted and verified.
     """
-    measured_boot_state = report["measured_boot_state"]
+    try:
+        measured_boot_state = expand_refstate(
+            report["measured_boot_state"], signature_sets,
+        )
+    except KeyError as e:
+        log.error(
+            "Cannot enroll agent %s: signature set %s missing"
+            " from %s",
+            uuid, e, signature_sets.directory,
+        )
+        return False
 
     log.info(
         "Enrolling agent %s (measured_boot_state keys: %s)",
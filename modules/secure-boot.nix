@@ -54,6 +54,7 @@ in
     pkgs.efitools
     tpm2-tools
     enroll-secure-boot
+    measuredBoot.measured-boot
     measuredBoot.measure-boot-state
     measuredBoot.report-measured-boot-state
     measuredBoot.debug-measured-boot-state
@@ -0,0 +1,157 @@
+"""Benchmarks for the uki measured boot policy.
+
+Not collected by pytest; run directly from this directory
+(with keylime importable)::
+
+    python bench_measured_boot_policy.py
+
+Builds a synthetic refstate and the matching parsed event log
+(as keylime hands them to the policy) for several dbx sizes,
+and prints the per-call cost of each step of an evaluation:
+fingerprinting the refstate (the test cache key) next to the
+canonical JSON digest it replaced, compiling the test tree,
+a cached ``refstate_to_test``, walking the compiled tree over
+the event log, and ``evaluate`` without and with a verdict
+cache hit.  A cache only pays off while its key is much
+cheaper than what it saves.
+"""
+
+import hashlib
+import json
+import timeit
+from typing import Any, Callable, Dict, List, Tuple
+
+from measured_boot_policy import UkiPolicy, fingerprint
+
+EFI_GLOBAL = "8be4df61-93ca-11d2-aa0d-00e098032b8c"
+EFI_IMAGE_SEC_DB = "d719b2cb-3d3a-4596-a3bc-dad00e67656f"
+EFI_CERT_X509 = "a5c059a1-94e4-4aa7-87b5-ab155c2bf072"
+EFI_CERT_SHA256 = "c1c41626-504c-4092-aca9-41f936934328"
+OWNER = "77fa9abd-0359-4d32-bd60-28f4e78f784b"
+
+# (firmware blobs, dbx entries)
+SHAPES = [(20, 100), (60, 430), (60, 4000)]
+
+
+def _event(
+    pcr: int, event_type: str, digest: str, event: Any = None,
+) -> Dict[str, Any]:
+    ev: Dict[str, Any] = {
+        "PCRIndex": pcr,
+        "EventType": event_type,
+        "Digests": [{"AlgorithmId": "sha256", "Digest": digest}],
+    }
+    if event is not None:
+        ev["Event"] = event
+    return ev
+
+
+def _sig(data: str) -> Dict[str, str]:
+    return {"SignatureOwner": OWNER, "SignatureData": data}
+
+
+def synthetic_case(
+    blobs: int, dbx: int,
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """A refstate and a parsed event log it accepts."""
+    scrtm = "aa" * 32
+    uki = "cc" * 32
+    firmware = [f"{i:064x}" for i in range(blobs)]
+    cert = "30" * 800
+    keys = {
+        "pk": (EFI_GLOBAL, "PK", EFI_CERT_X509, [cert]),
+        "kek": (EFI_GLOBAL, "KEK", EFI_CERT_X509, [cert] * 2),
+        "db": (EFI_IMAGE_SEC_DB, "db", EFI_CERT_X509, [cert] * 3),
+        "dbx": (
+            EFI_IMAGE_SEC_DB, "dbx", EFI_CERT_SHA256,
+            [f"{i:064x}" for i in range(dbx)],
+        ),
+    }
+    refstate: Dict[str, Any] = {
+        "scrtm_and_bios": [{
+            "scrtm": {"sha256": f"0x{scrtm}"},
+            "platform_firmware": [
+                {"sha256": f"0x{d}"} for d in firmware
+            ],
+        }],
+        **{
+            name: [_sig(f"0x{d}") for d in data]
+            for name, (_, _, _, data) in keys.items()
+        },
+        "uki_digest": {"sha256": f"0x{uki}"},
+    }
+    events: List[Dict[str, Any]] = [
+        _event(0, "EV_NO_ACTION", "00" * 32),
+        _event(0, "EV_S_CRTM_VERSION", scrtm),
+    ]
+    events += [
+        _event(0, "EV_EFI_PLATFORM_FIRMWARE_BLOB", d) for d in firmware
+    ]
+    events.append(_event(
+        7, "EV_EFI_VARIABLE_DRIVER_CONFIG", "00" * 32, {
+            "VariableName": EFI_GLOBAL,
+            "UnicodeName": "SecureBoot",
+            "VariableData": {"Enabled": "Yes"},
+        },
+    ))
+    for guid, name, sig_type, data in keys.values():
+        events.append(_event(
+            7, "EV_EFI_VARIABLE_DRIVER_CONFIG", "00" * 32, {
+                "VariableName": guid,
+                "UnicodeName": name,
+                "VariableData": [{
+                    "SignatureType": sig_type,
+                    "Keys": [_sig(d) for d in data],
+                }],
+            },
+        ))
+    for pcr in range(8):
+        events.append(_event(
+            pcr, "EV_SEPARATOR",
+            hashlib.sha256(bytes(4)).hexdigest(), "00000000",
+        ))
+    events.append(_event(4, "EV_EFI_BOOT_SERVICES_APPLICATION", uki))
+    events.append(_event(5, "EV_EFI_GPT_EVENT", "00" * 32))
+    return refstate, {"events": events}
+
+
+def _canonical_json_digest(data: Any) -> str:
+    canonical = json.dumps(data, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def _best_of(func: Callable[[], Any], number: int = 20) -> float:
+    """Best per-call time in seconds over several repeats."""
+    return min(timeit.repeat(func, number=number, repeat=9)) / number
+
+
+def main() -> None:
+    names = [
+        "fingerprint", "canonical json", "compile_test",
+        "refstate_to_test", "walk", "evaluate", "evaluate (hit)",
+    ]
+    print(f"{'blobs':>6} {'dbx':>6}" + "".join(
+        f" {name:>17}" for name in names
+    ))
+    for blobs, dbx in SHAPES:
+        rs, el = synthetic_case(blobs, dbx)
+        policy = UkiPolicy()
+        uncached = UkiPolicy(verdict_cache_size=0)
+        assert policy.evaluate(rs, el) == ""
+        test = policy.refstate_to_test(rs)
+        cases: List[Callable[[], Any]] = [
+            lambda: fingerprint(rs),
+            lambda: _canonical_json_digest(rs),
+            lambda: policy.compile_test(rs),
+            lambda: policy.refstate_to_test(rs),
+            lambda: test.why_not({}, el),
+            lambda: uncached.evaluate(rs, el),
+            lambda: policy.evaluate(rs, el),
+        ]
+        print(f"{blobs:>6} {dbx:>6}" + "".join(
+            f" {_best_of(case) * 1e3:>15.3f}ms" for case in cases
+        ))
+
+
+if __name__ == "__main__":
+    main()
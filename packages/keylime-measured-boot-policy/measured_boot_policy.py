@@ -6,7 +6,13 @@ event log.  See ``README.md`` in this directory for the full
 policy description, reference state schema, and testing instructions.
 """
 
+import collections
+import hashlib
+import marshal
 import re
+import threading
+import time
+import types
 import typing
 
 from keylime.mba.elchecking import policies, tests
@@ -15,8 +21,10 @@ from keylime.mba.elchecking import policies, tests
 # depending on firmware/parser.  The standard UEFI form has the
 # first three fields in big-endian; the mixed-endian form (as
 # seen in some tpm2_eventlog output) byte-swaps those fields.
-# We define each GUID once in standard form and derive the
-# mixed-endian variant, then match both.
+# We define each GUID once in standard form, derive the
+# mixed-endian variant, and rewrite known mixed-endian GUIDs
+# in the event log to standard form before evaluation (see
+# canonical_guids), so each test only needs the standard form.
 
 
 def _guid_both_forms(standard: str) -> typing.Tuple[str, str]:
@@ -37,22 +45,93 @@ def _guid_both_forms(standard: str) -> typing.Tuple[str, str]:
 
 
 # EFI_GLOBAL_VARIABLE: namespace for SecureBoot, PK, KEK
-EFI_GLOBAL_VARIABLE = _guid_both_forms(
-    "8be4df61-93ca-11d2-aa0d-00e098032b8c"
-)
+EFI_GLOBAL_VARIABLE = "8be4df61-93ca-11d2-aa0d-00e098032b8c"
 # EFI_IMAGE_SECURITY_DATABASE_GUID: namespace for db, dbx
-EFI_IMAGE_SECURITY_DATABASE = _guid_both_forms(
-    "d719b2cb-3d3a-4596-a3bc-dad00e67656f"
-)
+EFI_IMAGE_SECURITY_DATABASE = "d719b2cb-3d3a-4596-a3bc-dad00e67656f"
 # EFI_CERT_X509_GUID: X.509 certificate signature type
-EFI_CERT_X509 = _guid_both_forms(
-    "a5c059a1-94e4-4aa7-87b5-ab155c2bf072"
-)
+EFI_CERT_X509 = "a5c059a1-94e4-4aa7-87b5-ab155c2bf072"
 # EFI_CERT_SHA256_GUID: SHA-256 hash signature type
-EFI_CERT_SHA256 = _guid_both_forms(
-    "c1c41626-504c-4092-aca9-41f936934328"
+EFI_CERT_SHA256 = "c1c41626-504c-4092-aca9-41f936934328"
+
+# mixed-endian form -> standard form
+GUID_ALIASES = dict(
+    _guid_both_forms(guid)
+    for guid in (
+        EFI_GLOBAL_VARIABLE,
+        EFI_IMAGE_SECURITY_DATABASE,
+        EFI_CERT_X509,
+        EFI_CERT_SHA256,
+    )
 )
 
+VARIABLE_EVENT_TYPES = frozenset([
+    "EV_EFI_VARIABLE_DRIVER_CONFIG",
+    "EV_EFI_VARIABLE_AUTHORITY",
+])
+
+
+def _canonical_guid(guid: tests.Data) -> tests.Data:
+    if isinstance(guid, str):
+        return GUID_ALIASES.get(guid, guid)
+    return guid
+
+
+def _canonical_event(event: tests.Data) -> tests.Data:
+    if (not isinstance(event, dict)
+            or event.get("EventType") not in VARIABLE_EVENT_TYPES):
+        return event
+    data = event.get("Event")
+    if not isinstance(data, dict):
+        return event
+    data = dict(data)
+    if "VariableName" in data:
+        data["VariableName"] = _canonical_guid(data["VariableName"])
+    var_data = data.get("VariableData")
+    if isinstance(var_data, list):
+        data["VariableData"] = [
+            {
+                **sig_list,
+                "SignatureType": _canonical_guid(
+                    sig_list["SignatureType"],
+                ),
+            }
+            if isinstance(sig_list, dict)
+            and "SignatureType" in sig_list
+            else sig_list
+            for sig_list in var_data
+        ]
+    return {**event, "Event": data}
+
+
+def canonical_guids(eventlog: tests.Data) -> tests.Data:
+    """Return ``eventlog`` with known GUIDs in standard form.
+
+    Rewrites the VariableName and SignatureType of UEFI variable
+    events.  Rewritten events are copies; the input is not
+    modified.
+    """
+    if not isinstance(eventlog, dict):
+        return eventlog
+    events = eventlog.get("events")
+    if not isinstance(events, list):
+        return eventlog
+    return {
+        **eventlog,
+        "events": [_canonical_event(e) for e in events],
+    }
+
+
+class CanonicalGuids(tests.Test):
+    """Applies ``test`` to the event log after canonical_guids."""
+
+    def __init__(self, test: tests.Test):
+        super().__init__()
+        self.test = test
+
+    def why_not(self, globs: tests.Globals, subject: tests.Data) -> str:
+        return self.test.why_not(globs, canonical_guids(subject))
+
+
 hex_pat = re.compile("0x[0-9a-f]+")
 
 
@@ -97,6 +176,359 @@ def sigs_strip0x(
     ]
 
 
+class OnceTest(tests.Test):
+    """Like ``tests.OnceTest``, but keeps its state in ``globs``.
+
+    keylime's OnceTest flags itself as executed, so a test tree
+    could only ever be evaluated once.  Recording execution in
+    the per-evaluation globals instead lets a compiled tree be
+    cached and shared between evaluations (and threads).
+    """
+
+    def __init__(self, test: tests.Test):
+        self.test = test
+
+    def why_not(self, globs: tests.Globals, subject: tests.Data) -> str:
+        executed = globs.setdefault("_once_executed", set())
+        assert isinstance(executed, set)
+        if id(self) in executed:
+            return "test was already run once"
+        executed.add(id(self))
+        return self.test.why_not(globs, subject)
+
+
+class CacheInfo(typing.NamedTuple):
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+
+def fingerprint(data: typing.Any) -> typing.Optional[str]:
+    """Return a SHA-256 hex digest of ``data``'s marshal form.
+
+    Several times cheaper than hashing canonical JSON, but not
+    canonical: dict key order and which objects are shared
+    both show up in it, so equal values can get different
+    fingerprints (which only costs a cache miss).  Returns
+    None if ``data`` holds values marshal cannot serialise.
+    """
+    try:
+        return hashlib.sha256(marshal.dumps(data)).hexdigest()
+    except ValueError:
+        return None
+
+
+class LruCache:
+    """Bounded, thread-safe LRU mapping with optional TTL.
+
+    Entries older than ``ttl`` seconds are treated as missing.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 128,
+        ttl: typing.Optional[float] = None,
+        clock: typing.Callable[[], float] = time.monotonic,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._entries: typing.OrderedDict[
+            str, typing.Tuple[float, typing.Any]
+        ] = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> typing.Any:
+        """Return the cached value, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None:
+                if self.clock() - entry[0] >= self.ttl:
+                    del self._entries[key]
+                    entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: str, value: typing.Any) -> None:
+        with self._lock:
+            self._entries[key] = (self.clock(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def cache_info(self) -> CacheInfo:
+        with self._lock:
+            return CacheInfo(
+                self.hits, self.misses,
+                self.maxsize, len(self._entries),
+            )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+DISPATCH_KEYS = ("PCRIndex", "EventType")
+
+
+def _static_handlers() -> typing.Mapping[
+    typing.Tuple[int, str], tests.Test,
+]:
+    """Build the dispatcher entries that do not depend on refstate.
+
+    Built once at import time and shared by every compiled test.
+    Sharing is safe because these tests are stateless per
+    evaluation (OnceTest above keeps its state in ``globs``).
+    """
+    dispatcher = tests.Dispatcher(DISPATCH_KEYS)
+
+    # PCR 0 events
+    dispatcher.set(
+        (0, "EV_NO_ACTION"),
+        OnceTest(tests.AcceptAll()),
+    )
+    # Older TCG event type used by some firmware to measure
+    # POST code blobs into PCR 0.  PCR 0 is in
+    # relevant_pcr_indices so the digest is covered by the
+    # end-to-end quote comparison regardless.
+    dispatcher.set(
+        (0, "EV_POST_CODE"),
+        tests.AcceptAll(),
+    )
+
+    # PCR 1 events -- accept all (varies with config)
+    dispatcher.set(
+        (1, "EV_PLATFORM_CONFIG_FLAGS"),
+        tests.AcceptAll(),
+    )
+    dispatcher.set(
+        (1, "EV_EFI_VARIABLE_BOOT"),
+        tests.AcceptAll(),
+    )
+    dispatcher.set(
+        (1, "EV_EFI_HANDOFF_TABLES"),
+        tests.AcceptAll(),
+    )
+    dispatcher.set(
+        (1, "EV_EFI_HANDOFF_TABLES2"),
+        tests.AcceptAll(),
+    )
+    dispatcher.set(
+        (1, "EV_CPU_MICROCODE"),
+        tests.AcceptAll(),
+    )
+    dispatcher.set(
+        (1, "EV_EFI_ACTION"),
+        tests.EvEfiActionTest(1),
+    )
+    # Newer UEFI spec variant of EV_EFI_VARIABLE_BOOT,
+    # used by recent firmware for boot variable measurements.
+    dispatcher.set(
+        (1, "EV_EFI_VARIABLE_BOOT2"),
+        tests.AcceptAll(),
+    )
+
+    # PCR 2 -- boot services drivers (accept)
+    dispatcher.set(
+        (2, "EV_EFI_BOOT_SERVICES_DRIVER"),
+        tests.AcceptAll(),
+    )
+    # Some firmware measures option ROM code into PCR 2
+    # using the older EV_POST_CODE type.  PCR 2 is in
+    # relevant_pcr_indices so the quote comparison covers it.
+    dispatcher.set(
+        (2, "EV_POST_CODE"),
+        tests.AcceptAll(),
+    )
+
+    # PCR 4 -- EFI actions around the UKI application
+    dispatcher.set(
+        (4, "EV_EFI_ACTION"),
+        tests.EvEfiActionTest(4),
+    )
+
+    # PCR 5
+    dispatcher.set(
+        (5, "EV_EFI_GPT_EVENT"),
+        OnceTest(tests.AcceptAll()),
+    )
+    dispatcher.set(
+        (5, "EV_EFI_ACTION"),
+        tests.EvEfiActionTest(5),
+    )
+
+    # PCR 6 -- Host Platform Manufacturer Specific.
+    # PCR 6 is not in relevant_pcr_indices, so its value is
+    # not checked end-to-end against the quote (the verifier
+    # also skips it in tpm_policy).  These handlers exist
+    # solely to prevent the dispatcher from rejecting events
+    # that firmware emits here; they provide no integrity
+    # guarantee beyond what the separator already covers.
+    dispatcher.set(
+        (6, "EV_EFI_ACTION"),
+        tests.AcceptAll(),
+    )
+
+    # PCR 7 -- authority events: accept (we pin db)
+    vd_authority = tests.VariableDispatch()
+    vd_authority.set(
+        EFI_IMAGE_SECURITY_DATABASE, "db",
+        OnceTest(tests.AcceptAll()),
+    )
+    dispatcher.set(
+        (7, "EV_EFI_VARIABLE_AUTHORITY"),
+        vd_authority,
+    )
+
+    # Separators for PCRs 0-15.
+    # range(8) covered the firmware PCRs; extend to 15 because
+    # some firmware also emits separators for PCRs 8-15 to
+    # mark the end of each measurement phase.
+    for pcr in range(16):
+        dispatcher.set(
+            (pcr, "EV_SEPARATOR"),
+            tests.EvSeperatorTest(),
+        )
+
+    # PCR 9 -- EV_EVENT_TAG from systemd-stub (accept)
+    dispatcher.set(
+        (9, "EV_EVENT_TAG"),
+        tests.AcceptAll(),
+    )
+
+    # PCR 11 -- UKI PE sections from systemd-stub.
+    # Accepted here; the raw tpm_policy digest for PCR 11
+    # covers both these events and systemd-pcrphase.
+    dispatcher.set(
+        (11, "EV_IPL"),
+        tests.AcceptAll(),
+    )
+
+    return types.MappingProxyType(dispatcher.tests)
+
+
+STATIC_HANDLERS = _static_handlers()
+
+SECURE_BOOT_ENABLED = tests.FieldTest(
+    "Enabled", tests.StringEqual("Yes"),
+)
+
+
+SignatureIndex = typing.FrozenSet[typing.Tuple[str, str]]
+
+
+def signature_index(
+    sigs: typing.Iterable[typing.Dict[str, str]],
+) -> SignatureIndex:
+    """Return the (SignatureOwner, SignatureData) set of ``sigs``."""
+    return frozenset(
+        (s["SignatureOwner"], s["SignatureData"])
+        for s in sigs_strip0x(sigs)
+    )
+
+
+def _signature_key(
+    sig: tests.Data,
+) -> typing.Optional[typing.Tuple[str, str]]:
+    if not isinstance(sig, dict):
+        return None
+    owner = sig.get("SignatureOwner")
+    data = sig.get("SignatureData")
+    if not isinstance(owner, str) or not isinstance(data, str):
+        return None
+    return (owner, data)
+
+
+class KeySubset(tests.Test):
+    """Every signature list has an allowed type and known keys.
+
+    Set-indexed replacement for ``tests.KeySubset`` and
+    ``tests.KeySubsetMulti``: each key is a hash lookup, so the
+    cost is linear in the number of keys in the event.
+    """
+
+    def __init__(
+        self,
+        sig_types: typing.Iterable[str],
+        keys: SignatureIndex,
+    ):
+        super().__init__()
+        self.sig_types = frozenset(sig_types)
+        self.keys = keys
+
+    def why_not(self, globs: tests.Globals, subject: tests.Data) -> str:
+        if not isinstance(subject, list):
+            return "is not a list"
+        for idx, sig_list in enumerate(subject):
+            if not isinstance(sig_list, dict):
+                return f"[{idx}] is not a dict"
+            sig_type = sig_list.get("SignatureType")
+            if sig_type not in self.sig_types:
+                return (
+                    f"[{idx}] SignatureType {sig_type!a} is not"
+                    f" one of {sorted(self.sig_types)}"
+                )
+            keys = sig_list.get("Keys")
+            if not isinstance(keys, list):
+                return f"[{idx}] Keys is not a list"
+            for kidx, sig in enumerate(keys):
+                if _signature_key(sig) not in self.keys:
+                    return (
+                        f"[{idx}] Keys [{kidx}] {sig!a}"
+                        " is not an allowed signature"
+                    )
+        return ""
+
+
+class KeySuperset(tests.Test):
+    """One signature list of the given type containing all keys.
+
+    Set-indexed replacement for ``tests.KeySuperset``.
+    """
+
+    def __init__(self, sig_type: str, keys: SignatureIndex):
+        super().__init__()
+        self.sig_type = sig_type
+        self.keys = keys
+
+    def why_not(self, globs: tests.Globals, subject: tests.Data) -> str:
+        if not isinstance(subject, list):
+            return "is not a list"
+        if len(subject) != 1:
+            return f"has {len(subject)} signature lists, expected 1"
+        sig_list = subject[0]
+        if not isinstance(sig_list, dict):
+            return "[0] is not a dict"
+        sig_type = sig_list.get("SignatureType")
+        if sig_type != self.sig_type:
+            return (
+                f"[0] SignatureType {sig_type!a}"
+                f" is not {self.sig_type!a}"
+            )
+        keys = sig_list.get("Keys")
+        if not isinstance(keys, list):
+            return "[0] Keys is not a list"
+        actual = set()
+        for sig in keys:
+            key = _signature_key(sig)
+            if key is None:
+                return f"[0] Keys member {sig!a} is not a signature"
+            actual.add(key)
+        missing = self.keys - actual
+        if missing:
+            return f"[0] Keys lacks signatures {sorted(missing)}"
+        return ""
+
+
 class UkiPolicy(policies.Policy):
     """Measured boot policy for UKI boot chains."""
 
@@ -135,18 +567,77 @@ class UkiPolicy(policies.Policy):
         [0, 1, 2, 3, 4, 5, 7],
     )
 
+    def __init__(
+        self,
+        cache_size: int = 128,
+        verdict_cache_size: int = 1024,
+        verdict_ttl: float = 600.0,
+    ):
+        # Most of a fleet shares a handful of refstates, so
+        # compiled tests are cached and reused across
+        # attestations.  Failed compilations are not cached.
+        self.test_cache = LruCache(cache_size)
+        # An agent sends the same event log on every quote for
+        # the whole boot, so accepting verdicts are memoised per
+        # (refstate, event log) fingerprint.  Rejections are
+        # never cached: they are re-evaluated so that every
+        # failure carries a freshly computed explanation.
+        self.verdict_cache = LruCache(
+            verdict_cache_size, ttl=verdict_ttl,
+        )
+
     def get_relevant_pcrs(self) -> typing.FrozenSet[int]:
         return self.relevant_pcr_indices
 
     def refstate_to_test(
         self, refstate: policies.RefState,
     ) -> tests.Test:
+        return self._refstate_test(refstate, fingerprint(refstate))
+
+    def _refstate_test(
+        self, refstate: policies.RefState, key: typing.Optional[str],
+    ) -> tests.Test:
+        """The compiled test for *refstate*, whose fingerprint is *key*."""
         if not isinstance(refstate, dict):
             raise Exception(
                 "Expected refstate to be a dict,"
                 f" got {type(refstate).__name__}"
             )
-
+        # keylime parses the stored refstate afresh for every
+        # quote, always in the same key order, so an exact
+        # fingerprint is as good a key as a canonical one and
+        # much cheaper than compiling.
+        if key is None:
+            return self.compile_test(refstate)
+        test = self.test_cache.get(key)
+        if test is None:
+            # Compiled outside the cache lock; concurrent misses
+            # on the same refstate both compile and the later
+            # result wins.
+            test = self.compile_test(refstate)
+            self.test_cache.put(key, test)
+        return typing.cast(tests.Test, test)
+
+    def evaluate(
+        self, refstate: policies.RefState, eventlog: tests.Data,
+    ) -> str:
+        key = fingerprint(refstate)
+        verdict_key = None
+        if key is not None and self.verdict_cache.maxsize > 0:
+            log_key = fingerprint(eventlog)
+            if log_key is not None:
+                verdict_key = f"{key}:{log_key}"
+                if self.verdict_cache.get(verdict_key) is not None:
+                    return ""
+        test = self._refstate_test(refstate, key)
+        reason = test.why_not({}, eventlog)
+        if reason == "" and verdict_key is not None:
+            self.verdict_cache.put(verdict_key, reason)
+        return reason
+
+    def compile_test(
+        self, refstate: typing.Dict[str, typing.Any],
+    ) -> tests.Test:
         # Validate required fields
         for req in (
             "scrtm_and_bios", "pk", "kek", "db",
@@ -206,73 +697,11 @@ class UkiPolicy(policies.Policy):
             "uki_apps",
         )
 
-        dispatcher = tests.Dispatcher(
-            ("PCRIndex", "EventType"),
-        )
+        dispatcher = tests.Dispatcher(DISPATCH_KEYS)
+        for key, handler in STATIC_HANDLERS.items():
+            dispatcher.set(key, handler)
 
-        # PCR 0 events
-        dispatcher.set(
-            (0, "EV_NO_ACTION"),
-            tests.OnceTest(tests.AcceptAll()),
-        )
-        # Older TCG event type used by some firmware to measure
-        # POST code blobs into PCR 0.  PCR 0 is in
-        # relevant_pcr_indices so the digest is covered by the
-        # end-to-end quote comparison regardless.
-        dispatcher.set(
-            (0, "EV_POST_CODE"),
-            tests.AcceptAll(),
-        )
-        dispatcher.set(
-            (0, "EV_S_CRTM_VERSION"),
-            events_final.get("s_crtms"),
-        )
-        dispatcher.set(
-            (0, "EV_EFI_PLATFORM_FIRMWARE_BLOB"),
-            events_final.get("platform_firmware_blobs"),
-        )
-        dispatcher.set(
-            (0, "EV_EFI_PLATFORM_FIRMWARE_BLOB2"),
-            events_final.get("platform_firmware_blobs"),
-        )
-
-        # PCR 1 events -- accept all (varies with config)
-        dispatcher.set(
-            (1, "EV_PLATFORM_CONFIG_FLAGS"),
-            tests.AcceptAll(),
-        )
-        dispatcher.set(
-            (1, "EV_EFI_VARIABLE_BOOT"),
-            tests.AcceptAll(),
-        )
-        dispatcher.set(
-            (1, "EV_EFI_HANDOFF_TABLES"),
-            tests.AcceptAll(),
-        )
-        dispatcher.set(
-            (1, "EV_EFI_HANDOFF_TABLES2"),
-            tests.AcceptAll(),
-        )
-        dispatcher.set(
-            (1, "EV_CPU_MICROCODE"),
-            tests.AcceptAll(),
-        )
-        dispatcher.set(
-            (1, "EV_EFI_ACTION"),
-            tests.EvEfiActionTest(1),
-        )
-        # Newer UEFI spec variant of EV_EFI_VARIABLE_BOOT,
-        # used by recent firmware for boot variable measurements.
-        dispatcher.set(
-            (1, "EV_EFI_VARIABLE_BOOT2"),
-            tests.AcceptAll(),
-        )
-
-        # PCR 2 -- boot services drivers (accept)
-        dispatcher.set(
-            (2, "EV_EFI_BOOT_SERVICES_DRIVER"),
-            tests.AcceptAll(),
-        )
+        # PCR 0 and 2 -- SCRTM and firmware blobs.
         # Some firmware measures option ROM / UEFI driver blobs
         # into PCR 2 using EV_EFI_PLATFORM_FIRMWARE_BLOB rather
         # than EV_EFI_BOOT_SERVICES_DRIVER.  Feed these into the
@@ -280,154 +709,66 @@ class UkiPolicy(policies.Policy):
         # measure-boot-state captures blobs from all PCRs into
         # the refstate, so the policy must match them the same way.
         dispatcher.set(
-            (2, "EV_EFI_PLATFORM_FIRMWARE_BLOB"),
-            events_final.get("platform_firmware_blobs"),
-        )
-        dispatcher.set(
-            (2, "EV_EFI_PLATFORM_FIRMWARE_BLOB2"),
-            events_final.get("platform_firmware_blobs"),
-        )
-        # Some firmware measures option ROM code into PCR 2
-        # using the older EV_POST_CODE type.  PCR 2 is in
-        # relevant_pcr_indices so the quote comparison covers it.
-        dispatcher.set(
-            (2, "EV_POST_CODE"),
-            tests.AcceptAll(),
+            (0, "EV_S_CRTM_VERSION"),
+            events_final.get("s_crtms"),
         )
+        for pcr in (0, 2):
+            dispatcher.set(
+                (pcr, "EV_EFI_PLATFORM_FIRMWARE_BLOB"),
+                events_final.get("platform_firmware_blobs"),
+            )
+            dispatcher.set(
+                (pcr, "EV_EFI_PLATFORM_FIRMWARE_BLOB2"),
+                events_final.get("platform_firmware_blobs"),
+            )
 
         # PCR 4 -- UKI application
-        dispatcher.set(
-            (4, "EV_EFI_ACTION"),
-            tests.EvEfiActionTest(4),
-        )
         dispatcher.set(
             (4, "EV_EFI_BOOT_SERVICES_APPLICATION"),
             events_final.get("uki_apps"),
         )
 
-        # PCR 5
-        dispatcher.set(
-            (5, "EV_EFI_GPT_EVENT"),
-            tests.OnceTest(tests.AcceptAll()),
-        )
-        dispatcher.set(
-            (5, "EV_EFI_ACTION"),
-            tests.EvEfiActionTest(5),
-        )
-
-        # PCR 6 -- Host Platform Manufacturer Specific.
-        # PCR 6 is not in relevant_pcr_indices, so its value is
-        # not checked end-to-end against the quote (the verifier
-        # also skips it in tpm_policy).  These handlers exist
-        # solely to prevent the dispatcher from rejecting events
-        # that firmware emits here; they provide no integrity
-        # guarantee beyond what the separator already covers.
-        dispatcher.set(
-            (6, "EV_EFI_ACTION"),
-            tests.AcceptAll(),
-        )
-
         # PCR 7 -- Secure Boot variables
         vd_config = tests.VariableDispatch()
-        vd_authority = tests.VariableDispatch()
 
-        sb_test = tests.FieldTest(
-            "Enabled", tests.StringEqual("Yes"),
-        )
-        for guid in EFI_GLOBAL_VARIABLE:
-            vd_config.set(guid, "SecureBoot", sb_test)
-
-            pk_test = tests.OnceTest(
-                tests.Or(*(
-                    tests.KeySubset(
-                        cert_guid,
-                        sigs_strip0x(refstate["pk"]),
-                    )
-                    for cert_guid in EFI_CERT_X509
-                ))
-            )
-            vd_config.set(guid, "PK", pk_test)
+        pk_index = signature_index(refstate["pk"])
+        kek_index = signature_index(refstate["kek"])
+        db_index = signature_index(refstate["db"])
+        dbx_index = signature_index(refstate["dbx"])
 
-            kek_test = tests.OnceTest(
-                tests.Or(*(
-                    tests.KeySubset(
-                        cert_guid,
-                        sigs_strip0x(refstate["kek"]),
-                    )
-                    for cert_guid in EFI_CERT_X509
-                ))
-            )
-            vd_config.set(guid, "KEK", kek_test)
-
-        for guid in EFI_IMAGE_SECURITY_DATABASE:
-            db_test = tests.OnceTest(
-                tests.Or(*(
-                    tests.KeySubsetMulti(
-                        [x509, sha256],
-                        sigs_strip0x(refstate["db"]),
-                    )
-                    for x509, sha256
-                    in zip(EFI_CERT_X509, EFI_CERT_SHA256)
-                ))
-            )
-            vd_config.set(guid, "db", db_test)
-
-            if refstate["dbx"]:
-                dbx_test = tests.OnceTest(
-                    tests.Or(*(
-                        tests.KeySuperset(
-                            sha256,
-                            sigs_strip0x(refstate["dbx"]),
-                        )
-                        for sha256 in EFI_CERT_SHA256
-                    ))
-                )
-            else:
-                dbx_test = tests.OnceTest(
-                    tests.AcceptAll(),
-                )
-            vd_config.set(guid, "dbx", dbx_test)
-
-            # Authority events -- accept (we pinned db)
-            vd_authority.set(
-                guid, "db",
-                tests.OnceTest(tests.AcceptAll()),
-            )
-
-        dispatcher.set(
-            (7, "EV_EFI_VARIABLE_DRIVER_CONFIG"),
-            vd_config,
+        vd_config.set(
+            EFI_GLOBAL_VARIABLE, "SecureBoot", SECURE_BOOT_ENABLED,
         )
-        dispatcher.set(
-            (7, "EV_EFI_VARIABLE_AUTHORITY"),
-            vd_authority,
+        vd_config.set(
+            EFI_GLOBAL_VARIABLE, "PK",
+            OnceTest(KeySubset([EFI_CERT_X509], pk_index)),
         )
-
-        # Separators for PCRs 0-15.
-        # range(8) covered the firmware PCRs; extend to 15 because
-        # some firmware also emits separators for PCRs 8-15 to
-        # mark the end of each measurement phase.
-        for pcr in range(16):
-            dispatcher.set(
-                (pcr, "EV_SEPARATOR"),
-                tests.EvSeperatorTest(),
+        vd_config.set(
+            EFI_GLOBAL_VARIABLE, "KEK",
+            OnceTest(KeySubset([EFI_CERT_X509], kek_index)),
+        )
+        vd_config.set(
+            EFI_IMAGE_SECURITY_DATABASE, "db",
+            OnceTest(KeySubset(
+                [EFI_CERT_X509, EFI_CERT_SHA256], db_index,
+            )),
+        )
+        if dbx_index:
+            dbx_test = OnceTest(
+                KeySuperset(EFI_CERT_SHA256, dbx_index),
             )
-
-        # PCR 9 -- EV_EVENT_TAG from systemd-stub (accept)
-        dispatcher.set(
-            (9, "EV_EVENT_TAG"),
-            tests.AcceptAll(),
+        else:
+            dbx_test = OnceTest(tests.AcceptAll())
+        vd_config.set(
+            EFI_IMAGE_SECURITY_DATABASE, "dbx", dbx_test,
         )
 
-        # PCR 11 -- UKI PE sections from systemd-stub.
-        # Accepted here; the raw tpm_policy digest for PCR 11
-        # covers both these events and systemd-pcrphase.
         dispatcher.set(
-            (11, "EV_IPL"),
-            tests.AcceptAll(),
+            (7, "EV_EFI_VARIABLE_DRIVER_CONFIG"),
+            vd_config,
         )
 
-        return tests.FieldTest(
+        return CanonicalGuids(tests.FieldTest(
             "events",
             tests.And(
                 events_final.get_initializer(),
@@ -437,7 +778,7 @@ class UkiPolicy(policies.Policy):
                 events_final,
             ),
             show_name=False,
-        )
+        ))
 
 
 policies.register("uki", UkiPolicy())
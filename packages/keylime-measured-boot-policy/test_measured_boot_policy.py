@@ -6,6 +6,7 @@ requiring a full NixOS VM test.
 """
 
 import hashlib
+import json
 import pytest
 
 from keylime.mba.elchecking import policies
@@ -15,7 +16,7 @@ import measured_boot_policy  # noqa: F401
 
 # --------------- constants ---------------
 
-# Standard-form UEFI GUIDs (matching index 1 in the policy)
+# Standard-form UEFI GUIDs (as defined in the policy)
 EFI_GLOBAL = "8be4df61-93ca-11d2-aa0d-00e098032b8c"
 EFI_IMAGE_SEC_DB = "d719b2cb-3d3a-4596-a3bc-dad00e67656f"
 EFI_CERT_X509 = "a5c059a1-94e4-4aa7-87b5-ab155c2bf072"
@@ -528,3 +529,287 @@ class TestPolicyRefstateValidation:
         rs["uki_digest"] = {"sha256": "no-0x-prefix"}
         with pytest.raises(Exception):
             policy.refstate_to_test(rs)
+
+
+class TestCompiledTestCache:
+    def test_repeated_evaluation(self, valid_refstate):
+        # Cached trees must not carry OnceTest state over from
+        # one evaluation to the next.
+        p = measured_boot_policy.UkiPolicy(verdict_cache_size=0)
+        for _ in range(3):
+            assert p.evaluate(valid_refstate, build_eventlog()) == ""
+        info = p.test_cache.cache_info()
+        assert (info.hits, info.misses, info.currsize) == (2, 1, 1)
+
+    def test_once_still_enforced(self, valid_refstate):
+        el = build_eventlog()
+        gpt = [e for e in el["events"]
+               if e["EventType"] == "EV_EFI_GPT_EVENT"]
+        el["events"].append(dict(gpt[0]))
+        p = measured_boot_policy.UkiPolicy()
+        assert "already run once" in p.evaluate(valid_refstate, el)
+
+    def test_key_survives_json_round_trip(self, valid_refstate):
+        # keylime hands the policy a fresh json.loads() of the
+        # stored refstate on every quote.
+        p = measured_boot_policy.UkiPolicy()
+        stored = json.dumps(valid_refstate)
+        first = p.refstate_to_test(json.loads(stored))
+        assert p.refstate_to_test(json.loads(stored)) is first
+        assert p.test_cache.cache_info().hits == 1
+        reordered = dict(reversed(list(valid_refstate.items())))
+        assert p.refstate_to_test(reordered) is not first
+        assert p.test_cache.cache_info().misses == 2
+
+    def test_distinct_refstates(self, valid_eventlog):
+        p = measured_boot_policy.UkiPolicy()
+        bad = build_refstate(uki="99" * 32)
+        assert p.evaluate(build_refstate(), valid_eventlog) == ""
+        assert p.evaluate(bad, valid_eventlog) != ""
+        assert p.test_cache.cache_info().misses == 2
+
+    def test_lru_eviction(self):
+        p = measured_boot_policy.UkiPolicy(cache_size=2)
+        a, b, c = (build_refstate(uki=f"{i:02x}" * 32)
+                   for i in range(3))
+        p.refstate_to_test(a)
+        p.refstate_to_test(b)
+        p.refstate_to_test(a)  # a is now most recently used
+        p.refstate_to_test(c)  # evicts b
+        info = p.test_cache.cache_info()
+        assert (info.hits, info.misses, info.currsize) == (1, 3, 2)
+        p.refstate_to_test(a)
+        assert p.test_cache.cache_info().hits == 2
+        p.refstate_to_test(b)
+        assert p.test_cache.cache_info().misses == 4
+
+    def test_invalid_refstate_not_cached(self):
+        p = measured_boot_policy.UkiPolicy()
+        rs = build_refstate()
+        rs["uki_digest"] = {"sha256": "no-0x-prefix"}
+        for _ in range(2):
+            with pytest.raises(Exception):
+                p.refstate_to_test(rs)
+        info = p.test_cache.cache_info()
+        assert (info.misses, info.currsize) == (2, 0)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestVerdictCache:
+    def test_accept_is_memoised(self, valid_refstate,
+                                valid_eventlog):
+        p = measured_boot_policy.UkiPolicy()
+        for _ in range(3):
+            assert p.evaluate(valid_refstate, valid_eventlog) == ""
+        info = p.verdict_cache.cache_info()
+        assert (info.hits, info.misses, info.currsize) == (2, 1, 1)
+        # The policy walk (and test lookup) ran only once.
+        assert p.test_cache.cache_info().misses == 1
+        assert p.test_cache.cache_info().hits == 0
+
+    def test_hit_on_reparsed_inputs(self, valid_refstate,
+                                    valid_eventlog):
+        p = measured_boot_policy.UkiPolicy()
+        stored = json.dumps([valid_refstate, valid_eventlog])
+        for _ in range(2):
+            assert p.evaluate(*json.loads(stored)) == ""
+        assert p.verdict_cache.cache_info().hits == 1
+
+    def test_disabled(self, valid_refstate, valid_eventlog):
+        p = measured_boot_policy.UkiPolicy(verdict_cache_size=0)
+        for _ in range(2):
+            assert p.evaluate(valid_refstate, valid_eventlog) == ""
+        info = p.verdict_cache.cache_info()
+        assert (info.hits, info.misses, info.currsize) == (0, 0, 0)
+
+    def test_rejection_not_cached(self, valid_eventlog):
+        p = measured_boot_policy.UkiPolicy()
+        bad = build_refstate(uki="99" * 32)
+        reasons = [p.evaluate(bad, valid_eventlog) for _ in range(2)]
+        assert reasons[0] != "" and reasons[0] == reasons[1]
+        info = p.verdict_cache.cache_info()
+        assert (info.hits, info.currsize) == (0, 0)
+
+    def test_keyed_by_eventlog(self, valid_refstate,
+                               valid_eventlog):
+        p = measured_boot_policy.UkiPolicy()
+        assert p.evaluate(valid_refstate, valid_eventlog) == ""
+        tampered = build_eventlog(uki="99" * 32)
+        assert p.evaluate(valid_refstate, tampered) != ""
+
+    def test_keyed_by_refstate(self, valid_refstate,
+                               valid_eventlog):
+        p = measured_boot_policy.UkiPolicy()
+        assert p.evaluate(valid_refstate, valid_eventlog) == ""
+        bad = build_refstate(uki="99" * 32)
+        assert p.evaluate(bad, valid_eventlog) != ""
+
+    def test_ttl_expiry(self, valid_refstate, valid_eventlog):
+        p = measured_boot_policy.UkiPolicy(verdict_ttl=60)
+        clock = FakeClock()
+        p.verdict_cache.clock = clock
+        p.evaluate(valid_refstate, valid_eventlog)
+        clock.now = 59
+        p.evaluate(valid_refstate, valid_eventlog)
+        assert p.verdict_cache.cache_info().hits == 1
+        clock.now = 60
+        p.evaluate(valid_refstate, valid_eventlog)
+        info = p.verdict_cache.cache_info()
+        assert (info.hits, info.misses) == (1, 2)
+
+
+class TestStaticHandlers:
+    def test_skeleton_is_read_only(self):
+        handlers = measured_boot_policy.STATIC_HANDLERS
+        with pytest.raises(TypeError):
+            handlers[(3, "EV_IPL")] = None
+        assert (0, "EV_S_CRTM_VERSION") not in handlers
+        assert (7, "EV_EFI_VARIABLE_DRIVER_CONFIG") not in handlers
+
+    def test_shared_across_refstates(self):
+        # Two refstates compile into trees sharing the static
+        # OnceTest handlers (EV_NO_ACTION, GPT, authority); each
+        # evaluation must still see them as unused.
+        p = measured_boot_policy.UkiPolicy(verdict_cache_size=0)
+        blobs = [["ab" * 32], ["ac" * 32]]
+        for _ in range(2):
+            for fw in blobs:
+                rs = build_refstate(fw_blobs=fw)
+                el = build_eventlog(fw_blobs=fw)
+                assert p.evaluate(rs, el) == ""
+
+
+def _sig(data, owner=KEY_OWNER):
+    return {"SignatureOwner": owner, "SignatureData": data}
+
+
+class TestSignatureIndex:
+    KNOWN = [_sig("01" * 32), _sig("02" * 32), _sig("03" * 32)]
+    SUBJECTS = [
+        [],
+        [{"SignatureType": EFI_CERT_X509, "Keys": KNOWN[:2]}],
+        [{"SignatureType": EFI_CERT_X509, "Keys": KNOWN},
+         {"SignatureType": EFI_CERT_SHA256, "Keys": KNOWN[2:]}],
+        [{"SignatureType": EFI_CERT_X509, "Keys": [_sig("04" * 32)]}],
+        [{"SignatureType": EFI_CERT_X509,
+          "Keys": [_sig("01" * 32, owner="other")]}],
+        [{"SignatureType": EFI_GLOBAL, "Keys": KNOWN[:1]}],
+        [{"SignatureType": EFI_CERT_SHA256, "Keys": KNOWN[::-1]}],
+        [{"SignatureType": EFI_CERT_SHA256, "Keys": KNOWN[:2]}],
+        [{"SignatureType": EFI_CERT_SHA256, "Keys": KNOWN},
+         {"SignatureType": EFI_CERT_SHA256, "Keys": KNOWN}],
+        [{"SignatureType": EFI_CERT_SHA256, "Keys": "x"}],
+        ["x"],
+        "x",
+    ]
+
+    def _compare(self, ours, theirs):
+        for subject in self.SUBJECTS:
+            assert (ours.why_not({}, subject) == "") == (
+                theirs.why_not({}, subject) == ""
+            ), subject
+
+    def test_subset_matches_keylime(self):
+        from keylime.mba.elchecking import tests
+
+        index = frozenset(
+            (k["SignatureOwner"], k["SignatureData"])
+            for k in self.KNOWN
+        )
+        self._compare(
+            measured_boot_policy.KeySubset([EFI_CERT_X509], index),
+            tests.KeySubset(EFI_CERT_X509, self.KNOWN),
+        )
+        types = [EFI_CERT_X509, EFI_CERT_SHA256]
+        self._compare(
+            measured_boot_policy.KeySubset(types, index),
+            tests.KeySubsetMulti(types, self.KNOWN),
+        )
+
+    def test_superset_matches_keylime(self):
+        from keylime.mba.elchecking import tests
+
+        index = frozenset(
+            (k["SignatureOwner"], k["SignatureData"])
+            for k in self.KNOWN
+        )
+        self._compare(
+            measured_boot_policy.KeySuperset(EFI_CERT_SHA256, index),
+            tests.KeySuperset(EFI_CERT_SHA256, self.KNOWN),
+        )
+
+    def test_signature_index_strips_0x(self):
+        index = measured_boot_policy.signature_index(
+            [_sig("0xab"), _sig("0xcd")],
+        )
+        assert index == {(KEY_OWNER, "ab"), (KEY_OWNER, "cd")}
+
+    def test_large_dbx(self, policy):
+        rs = build_refstate()
+        rs["dbx"] = [_sig(f"0x{i:064x}") for i in range(2000)]
+        el = build_eventlog()
+        dbx = [e for e in el["events"]
+               if isinstance(e.get("Event"), dict)
+               and e["Event"].get("UnicodeName") == "dbx"][0]
+        keys = [_sig(f"{i:064x}") for i in range(2000)]
+        dbx["Event"]["VariableData"][0]["Keys"] = keys
+        assert policy.evaluate(rs, el) == ""
+        del keys[1000]
+        assert "lacks" in policy.evaluate(rs, el)
+
+
+def mixed_guid(guid: str) -> str:
+    return measured_boot_policy._guid_both_forms(guid)[0]
+
+
+class TestCanonicalGuids:
+    def test_mixed_endian_log_accepted(self, policy,
+                                       valid_refstate):
+        el = build_eventlog()
+        for e in el["events"]:
+            ev = e.get("Event")
+            if not isinstance(ev, dict) or "VariableName" not in ev:
+                continue
+            ev["VariableName"] = mixed_guid(ev["VariableName"])
+            if isinstance(ev["VariableData"], list):
+                for sig_list in ev["VariableData"]:
+                    sig_list["SignatureType"] = mixed_guid(
+                        sig_list["SignatureType"],
+                    )
+        assert policy.evaluate(valid_refstate, el) == ""
+
+    def test_mixed_endian_wrong_key_rejected(self, policy,
+                                             valid_refstate):
+        el = build_eventlog(db_data="99" * 64)
+        for e in el["events"]:
+            ev = e.get("Event")
+            if isinstance(ev, dict) and ev.get("UnicodeName") == "db":
+                ev["VariableName"] = mixed_guid(EFI_IMAGE_SEC_DB)
+        assert policy.evaluate(valid_refstate, el) != ""
+
+    def test_input_not_modified(self):
+        el = build_eventlog()
+        for e in el["events"]:
+            ev = e.get("Event")
+            if isinstance(ev, dict) and ev.get("UnicodeName") == "PK":
+                ev["VariableName"] = mixed_guid(EFI_GLOBAL)
+                pk = ev
+        out = measured_boot_policy.canonical_guids(el)
+        assert pk["VariableName"] == mixed_guid(EFI_GLOBAL)
+        names = [e["Event"]["VariableName"] for e in out["events"]
+                 if isinstance(e.get("Event"), dict)
+                 and e["Event"].get("UnicodeName") == "PK"]
+        assert names == [EFI_GLOBAL]
+
+    def test_unknown_guid_unchanged(self):
+        other = "12345678-1234-1234-1234-123456789abc"
+        ev = make_var_config(other, "Foo", [{"SignatureType": other}])
+        out = measured_boot_policy.canonical_guids({"events": [ev]})
+        assert out["events"][0]["Event"] == ev["Event"]
@@ -0,0 +1,515 @@
+"""Benchmarks for the measured boot state library.
+
+Not collected by pytest; run directly from this directory::
+
+    python bench_measured_boot_state.py
+    python bench_measured_boot_state.py --check
+    python bench_measured_boot_state.py --save-baseline
+
+The suite writes synthetic binary TCG event logs and
+matching systemd userspace JSON-seq logs
+(``write_synthetic_logs``) in several shapes (firmware blobs,
+dbx size, EV_IPL events, userspace extensions) and times
+``parse_eventlog``, ``create_refstate``, ``replay_pcrs`` and
+``diff_refstates`` on each.  ``--check`` compares against the
+stored baseline (``bench_baseline.json``) and exits non-zero
+if any case got more than ``--tolerance`` slower.  Times in
+the baseline are relative to a fixed SHA-256 calibration
+loop, so a baseline saved on one machine stays meaningful on
+another; regenerate it with ``--save-baseline`` after an
+intended change.
+
+``--multi-pass`` instead compares the single-pass
+``create_refstate`` against the previous approach of running
+each ``get_*`` extractor over the whole log, on synthetic logs
+with many firmware blobs and large dbx variables: time per
+call on an in-memory event list, and peak memory when the
+events are produced by a stream (as ``iter_events`` does),
+which the multi-pass approach has to materialise first.  Time
+per call is about the same either way; the single pass is
+worth having for the lower peak memory on streamed logs.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import struct
+import sys
+import tempfile
+import timeit
+import tracemalloc
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+from measured_boot_state import (
+    create_refstate,
+    diff_refstates,
+    get_keys,
+    get_platform_firmware,
+    get_scrtm,
+    get_uki_digest,
+    parse_eventlog,
+    parse_userspace_log,
+    replay_pcrs,
+)
+
+BASELINE = Path(__file__).with_name("bench_baseline.json")
+
+EFI_GLOBAL = "8be4df61-93ca-11d2-aa0d-00e098032b8c"
+EFI_IMAGE_SEC_DB = "d719b2cb-3d3a-4596-a3bc-dad00e67656f"
+EFI_CERT_X509 = "a5c059a1-94e4-4aa7-87b5-ab155c2bf072"
+EFI_CERT_SHA256 = "c1c41626-504c-4092-aca9-41f936934328"
+OWNER = "77fa9abd-0359-4d32-bd60-28f4e78f784b"
+
+
+def _event(
+    pcr: int, event_type: str, n: int, body: Any = None,
+) -> Dict[str, Any]:
+    ev: Dict[str, Any] = {
+        "PCRIndex": pcr,
+        "EventType": event_type,
+        "Digests": [
+            {"AlgorithmId": "sha1", "Digest": f"{n:040x}"},
+            {"AlgorithmId": "sha256", "Digest": f"{n:064x}"},
+        ],
+    }
+    if body is not None:
+        ev["Event"] = body
+    return ev
+
+
+def _sig_var(
+    guid: str, name: str, sig_type: str, count: int, size: int,
+) -> Dict[str, Any]:
+    return {
+        "VariableName": guid,
+        "UnicodeName": name,
+        "VariableData": [{
+            "SignatureType": sig_type,
+            "Keys": [
+                {
+                    "SignatureOwner": OWNER,
+                    "SignatureData": f"{i:0{size * 2}x}",
+                }
+                for i in range(count)
+            ],
+        }],
+    }
+
+
+def iter_synthetic_events(
+    firmware_blobs: int, dbx_entries: int,
+) -> Iterator[Dict[str, Any]]:
+    """A UKI-shaped event log in tpm2_eventlog's schema."""
+    yield _event(0, "EV_NO_ACTION", 0)
+    yield _event(0, "EV_S_CRTM_VERSION", 1)
+    for i in range(firmware_blobs):
+        yield _event(
+            0, "EV_EFI_PLATFORM_FIRMWARE_BLOB", 100 + i,
+            {"BlobBase": i, "BlobLength": 4096},
+        )
+    yield _event(
+        7, "EV_EFI_VARIABLE_DRIVER_CONFIG", 2,
+        {
+            "VariableName": EFI_GLOBAL,
+            "UnicodeName": "SecureBoot",
+            "VariableData": {"Enabled": "Yes"},
+        },
+    )
+    for n, (guid, name, sig_type, count, size) in enumerate([
+        (EFI_GLOBAL, "PK", EFI_CERT_X509, 1, 800),
+        (EFI_GLOBAL, "KEK", EFI_CERT_X509, 2, 800),
+        (EFI_IMAGE_SEC_DB, "db", EFI_CERT_X509, 3, 800),
+        (
+            EFI_IMAGE_SEC_DB, "dbx", EFI_CERT_SHA256,
+            dbx_entries, 32,
+        ),
+    ]):
+        yield _event(
+            7, "EV_EFI_VARIABLE_DRIVER_CONFIG", 3 + n,
+            _sig_var(guid, name, sig_type, count, size),
+        )
+    for pcr in range(8):
+        yield _event(pcr, "EV_SEPARATOR", 10)
+    for i in range(firmware_blobs // 4):
+        yield _event(
+            2, "EV_EFI_BOOT_SERVICES_DRIVER", 5000 + i,
+            {"DevicePath": f"PciRoot(0x0)/Pci(0x{i:x},0x0)"},
+        )
+    yield _event(
+        4, "EV_EFI_ACTION", 11,
+        "Calling EFI Application from Boot Option",
+    )
+    yield _event(
+        4, "EV_EFI_BOOT_SERVICES_APPLICATION", 12,
+        {"DevicePath": "File(\\EFI\\BOOT\\BOOTX64.EFI)"},
+    )
+    for i in range(16):
+        yield _event(11, "EV_IPL", 9000 + i)
+
+
+def synthetic_events(
+    firmware_blobs: int, dbx_entries: int,
+) -> List[Dict[str, Any]]:
+    return list(iter_synthetic_events(firmware_blobs, dbx_entries))
+
+
+def multi_pass_refstate(
+    events: List[Dict[str, Any]],
+) -> Dict[str, Any]:
+    """Refstate built by one full walk per extractor."""
+    return {
+        "scrtm_and_bios": [{
+            **get_scrtm(events),
+            **get_platform_firmware(events),
+        }],
+        **get_keys(events),
+        "uki_digest": get_uki_digest(events),
+    }
+
+
+def _best_of(func: Callable[[], Any], number: int = 20) -> float:
+    """Best per-call time in seconds over several repeats."""
+    return min(timeit.repeat(func, number=number, repeat=9)) / number
+
+
+def _peak_kib(func: Callable[[], Any]) -> float:
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def bench_create_refstate() -> None:
+    print(
+        f"{'blobs':>6} {'dbx':>6} {'events':>7}"
+        f" {'multi-pass':>11} {'single-pass':>12} {'speedup':>8}"
+        f" {'peak multi':>11} {'peak single':>12}"
+    )
+    for blobs, dbx in [
+        (50, 100), (200, 400), (500, 1000), (1000, 4000),
+    ]:
+        events = synthetic_events(blobs, dbx)
+        assert json.dumps(create_refstate(events)) == json.dumps(
+            multi_pass_refstate(events),
+        )
+        multi = _best_of(lambda: multi_pass_refstate(events))
+        single = _best_of(lambda: create_refstate(events))
+        peak_multi = _peak_kib(lambda: multi_pass_refstate(
+            list(iter_synthetic_events(blobs, dbx)),
+        ))
+        peak_single = _peak_kib(lambda: create_refstate(
+            iter_synthetic_events(blobs, dbx),
+        ))
+        print(
+            f"{blobs:>6} {dbx:>6} {len(events):>7}"
+            f" {multi * 1e3:>9.3f}ms {single * 1e3:>10.3f}ms"
+            f" {multi / single:>7.2f}x"
+            f" {peak_multi:>8.0f}KiB {peak_single:>9.0f}KiB"
+        )
+
+
+# --- Synthetic binary logs ---
+
+ALG_SHA1 = 0x0004
+ALG_SHA256 = 0x000B
+EV_NO_ACTION = 0x00000003
+EV_SEPARATOR = 0x00000004
+EV_S_CRTM_VERSION = 0x00000008
+EV_IPL = 0x0000000D
+EV_EFI_VARIABLE_DRIVER_CONFIG = 0x80000001
+EV_EFI_BOOT_SERVICES_APPLICATION = 0x80000003
+EV_EFI_ACTION = 0x80000007
+EV_EFI_PLATFORM_FIRMWARE_BLOB = 0x80000008
+
+
+def _pack_guid(guid: str) -> bytes:
+    return uuid.UUID(guid).bytes_le
+
+
+def _spec_id_event() -> bytes:
+    """SHA1-format header declaring sha1 and sha256 banks."""
+    body = b"Spec ID Event03\x00" + struct.pack(
+        "<IBBBBI", 0, 0, 2, 0, 2, 2,
+    )
+    body += struct.pack("<HHHH", ALG_SHA1, 20, ALG_SHA256, 32)
+    body += b"\x00"
+    return struct.pack(
+        "<II20sI", 0, EV_NO_ACTION, bytes(20), len(body),
+    ) + body
+
+
+def _tcg_event(pcr: int, event_type: int, data: bytes) -> bytes:
+    """TCG_PCR_EVENT2 measuring *data* into both banks."""
+    return (
+        struct.pack("<IIIH", pcr, event_type, 2, ALG_SHA1)
+        + hashlib.sha1(data).digest()
+        + struct.pack("<H", ALG_SHA256)
+        + hashlib.sha256(data).digest()
+        + struct.pack("<I", len(data))
+        + data
+    )
+
+
+def _efi_variable(guid: str, name: str, data: bytes) -> bytes:
+    return (
+        _pack_guid(guid)
+        + struct.pack("<QQ", len(name), len(data))
+        + name.encode("utf-16-le")
+        + data
+    )
+
+
+def _signature_list(sig_type: str, count: int, size: int) -> bytes:
+    sig_size = 16 + size
+    sigs = b"".join(
+        _pack_guid(OWNER) + i.to_bytes(size, "big")
+        for i in range(count)
+    )
+    return _pack_guid(sig_type) + struct.pack(
+        "<III", 28 + sig_size * count, 0, sig_size,
+    ) + sigs
+
+
+def _file_device_path(path: str) -> bytes:
+    name = (path + "\0").encode("utf-16-le")
+    return (
+        struct.pack("<BBH", 0x04, 0x04, 4 + len(name)) + name
+        + struct.pack("<BBH", 0x7F, 0xFF, 4)
+    )
+
+
+def synthetic_log_bytes(
+    firmware_blobs: int = 50,
+    dbx_entries: int = 400,
+    ipl_events: int = 16,
+) -> bytes:
+    """A UKI-shaped binary crypto-agile TCG event log."""
+    events = [
+        _spec_id_event(),
+        _tcg_event(0, EV_S_CRTM_VERSION, "1.0".encode("utf-16-le")),
+    ]
+    for i in range(firmware_blobs):
+        events.append(_tcg_event(
+            0, EV_EFI_PLATFORM_FIRMWARE_BLOB,
+            struct.pack("<QQ", 0xFF000000 + i * 0x1000, 0x1000),
+        ))
+    events.append(_tcg_event(
+        7, EV_EFI_VARIABLE_DRIVER_CONFIG,
+        _efi_variable(EFI_GLOBAL, "SecureBoot", b"\x01"),
+    ))
+    for guid, name, sig_type, count, size in [
+        (EFI_GLOBAL, "PK", EFI_CERT_X509, 1, 800),
+        (EFI_GLOBAL, "KEK", EFI_CERT_X509, 2, 800),
+        (EFI_IMAGE_SEC_DB, "db", EFI_CERT_X509, 3, 800),
+        (EFI_IMAGE_SEC_DB, "dbx", EFI_CERT_SHA256, dbx_entries, 32),
+    ]:
+        events.append(_tcg_event(
+            7, EV_EFI_VARIABLE_DRIVER_CONFIG,
+            _efi_variable(
+                guid, name, _signature_list(sig_type, count, size),
+            ),
+        ))
+    for pcr in range(8):
+        events.append(_tcg_event(pcr, EV_SEPARATOR, bytes(4)))
+    events.append(_tcg_event(
+        4, EV_EFI_ACTION, b"Calling EFI Application from Boot Option",
+    ))
+    dp = _file_device_path("\\EFI\\BOOT\\BOOTX64.EFI")
+    events.append(_tcg_event(
+        4, EV_EFI_BOOT_SERVICES_APPLICATION,
+        struct.pack("<QQQQ", 0x7E000000, 0x100000, 0, len(dp)) + dp,
+    ))
+    for i in range(ipl_events):
+        events.append(_tcg_event(11, EV_IPL, f".sect{i}\0".encode()))
+    return b"".join(events)
+
+
+def synthetic_userspace_log(extensions: int = 8) -> str:
+    """systemd's RFC 7464 JSON-seq log, alternating PCR 9/11."""
+    records = []
+    for i in range(extensions):
+        word = f"phase-{i}".encode()
+        records.append("\x1e" + json.dumps({
+            "pcr": 11 if i % 2 else 9,
+            "digests": [
+                {
+                    "hashAlg": "sha256",
+                    "digest": hashlib.sha256(word).hexdigest(),
+                },
+            ],
+            "content_type": "systemd",
+            "content": {"string": word.decode()},
+        }) + "\n")
+    return "".join(records)
+
+
+def write_synthetic_logs(
+    directory: str,
+    firmware_blobs: int = 50,
+    dbx_entries: int = 400,
+    ipl_events: int = 16,
+    userspace_extensions: int = 8,
+) -> Tuple[str, str]:
+    """Write a binary event log and a userspace log.
+
+    Returns the paths of the two files, which can be passed to
+    ``parse_eventlog`` and ``parse_userspace_log``.
+    """
+    eventlog = os.path.join(directory, "binary_bios_measurements")
+    userspace = os.path.join(directory, "tpm2-measure.log")
+    with open(eventlog, "wb") as f:
+        f.write(synthetic_log_bytes(
+            firmware_blobs, dbx_entries, ipl_events,
+        ))
+    with open(userspace, "w") as f:
+        f.write(synthetic_userspace_log(userspace_extensions))
+    return eventlog, userspace
+
+
+# --- Regression suite ---
+
+# (name, firmware blobs, dbx entries, EV_IPL events,
+# userspace extensions)
+SUITE_SHAPES = [
+    ("small", 20, 100, 8, 4),
+    ("typical", 60, 430, 16, 8),
+    ("large-dbx", 60, 4000, 16, 8),
+    ("many-blobs", 1000, 430, 64, 64),
+]
+
+
+def _calibrate() -> float:
+    """Seconds for a fixed SHA-256 workload on this machine."""
+    data = bytes(64)
+
+    def work() -> None:
+        h = data
+        for _ in range(20000):
+            h = hashlib.sha256(h).digest()
+
+    return _best_of(work, number=5)
+
+
+def run_suite() -> Dict[str, float]:
+    """Time each library step on each shape.
+
+    Returns ``{"<shape>/<step>": calibrated time}``.
+    """
+    results: Dict[str, float] = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, blobs, dbx, ipl, ext in SUITE_SHAPES:
+            eventlog, userspace = write_synthetic_logs(
+                tmp, blobs, dbx, ipl, ext,
+            )
+            # parse_eventlog returns lazily decoded events; time
+            # create_refstate on a fresh parse so bodies are
+            # decoded inside the measured call, as in real use.
+            log = parse_eventlog(eventlog, cache_dir="")
+            assert log is not None
+            user = parse_userspace_log(userspace)
+            refstate = create_refstate(log["events"], user)
+            other = json.loads(json.dumps(refstate))
+            other["dbx"] = other["dbx"][1:] + other["dbx"][:1]
+            other["scrtm_and_bios"][0]["platform_firmware"].reverse()
+            steps: Dict[str, Callable[[], Any]] = {
+                "parse_eventlog": lambda: parse_eventlog(
+                    eventlog, cache_dir="",
+                ),
+                "create_refstate": lambda: create_refstate(
+                    parse_eventlog(eventlog, cache_dir="")["events"],
+                    user,
+                ),
+                "replay_pcrs": lambda: replay_pcrs(log["events"], user),
+                "diff_refstates": lambda: diff_refstates(
+                    refstate, other,
+                ),
+            }
+            for step, func in steps.items():
+                results[f"{name}/{step}"] = _best_of(func, number=5)
+    return results
+
+
+def bench_suite(
+    baseline_path: Path, save: bool, check: bool, tolerance: float,
+) -> int:
+    unit = _calibrate()
+    results = {k: v / unit for k, v in run_suite().items()}
+    baseline: Dict[str, float] = {}
+    if baseline_path.exists():
+        baseline = json.loads(baseline_path.read_text())["results"]
+
+    regressions = []
+    print(
+        f"{'case':<32} {'ms':>9} {'units':>8}"
+        f" {'baseline':>9} {'change':>8}"
+    )
+    for case, value in results.items():
+        base = baseline.get(case)
+        change = ""
+        if base:
+            ratio = value / base
+            change = f"{(ratio - 1) * 100:+.0f}%"
+            if ratio > 1 + tolerance:
+                regressions.append(case)
+                change += " !"
+        print(
+            f"{case:<32} {value * unit * 1e3:>9.3f} {value:>8.3f}"
+            f" {base or 0:>9.3f} {change:>8}"
+        )
+
+    if save:
+        baseline_path.write_text(json.dumps({
+            "unit": "seconds per call / calibration loop seconds",
+            "results": {k: round(v, 4) for k, v in results.items()},
+        }, indent=2, sort_keys=True) + "\n")
+        print(f"Saved baseline to {baseline_path}")
+    if check and regressions:
+        print(
+            f"{len(regressions)} case(s) regressed by more than"
+            f" {tolerance:.0%}: {', '.join(regressions)}",
+            file=sys.stderr,
+        )
+        return 1
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the measured boot state library",
+    )
+    parser.add_argument(
+        "--baseline", type=Path, default=BASELINE,
+        help=f"Baseline file (default: {BASELINE.name})",
+    )
+    parser.add_argument(
+        "--save-baseline", action="store_true",
+        help="Store this run as the new baseline",
+    )
+    parser.add_argument(
+        "--check", action="store_true",
+        help="Exit non-zero if any case regressed",
+    )
+    parser.add_argument(
+        "--tolerance", type=float, default=0.5,
+        help="Allowed slowdown for --check (default: 0.5 = 50%%)",
+    )
+    parser.add_argument(
+        "--multi-pass", action="store_true",
+        help="Compare single-pass and multi-pass create_refstate",
+    )
+    args = parser.parse_args()
+    if args.multi_pass:
+        bench_create_refstate()
+        return 0
+    return bench_suite(
+        args.baseline, args.save_baseline, args.check, args.tolerance,
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,24 +1,84 @@
 """Unit tests for the measured boot state library.
 
-Tests refstate generation, PCR replay, and refstate diffing
-using synthetic event data (no tpm2_eventlog required).
+Tests event log parsing, refstate generation, PCR replay, and
+refstate diffing using synthetic event data (no tpm2_eventlog
+required).
 """
 
+import asyncio
+import gzip
 import hashlib
+import io
 import json
+import os
+import shutil
+import socket
+import subprocess
+import struct
+import sys
+import threading
+import time
+import uuid
 import pytest
 
+import measured_boot_state
+
 from measured_boot_state import (
+    PCRPHASE_BOOTED,
+    Event,
+    PcrBank,
+    RefstateIndex,
+    SignatureSetStore,
+    StatsRecorder,
+    TpmDevice,
+    TpmError,
+    UserspaceLogReader,
+    add_stats_hook,
+    align_sequences,
+    canonicalize_refstate,
+    collect_debug_bundle,
+    compact_refstate,
     create_refstate,
+    create_refstate_async,
     diff_refstates,
     event_to_sha256,
+    expand_refstate,
+    find_pcr_divergence,
     get_keys,
     get_platform_firmware,
     get_scrtm,
     get_uki_digest,
+    iter_events,
+    iter_userspace_events,
+    missing_signature_sets,
+    parse_eventlog,
+    parse_eventlog_async,
     parse_userspace_log,
+    parse_userspace_log_async,
+    read_debug_bundle,
+    read_tpm_pcr_banks,
+    read_tpm_pcrs,
+    read_tpm_pcrs_async,
+    read_tpm_pcrs_device,
+    predict_pcr11,
+    refstate_digest,
+    refstate_from_bytes,
+    remove_stats_hook,
+    replay_events,
     replay_pcrs,
+    write_debug_bundle,
+    signature_set_digest,
+    uki_pcr11_events,
+    uki_sections,
 )
+
+
+@pytest.fixture(autouse=True)
+def no_eventlog_cache(monkeypatch):
+    """Keep parse_eventlog from writing to /run in tests."""
+    monkeypatch.setenv("MEASURED_BOOT_EVENTLOG_CACHE", "")
+
+
 DIGEST_AA = "aa" * 32
 DIGEST_BB = "bb" * 32
 DIGEST_CC = "cc" * 32
@@ -50,6 +110,88 @@ def make_fw_app(pcr, digest, device_path=""):
         event_data={"DevicePath": device_path},
     )
 
+
+# --- Binary TCG event log encoding ---
+
+ALG_SHA1 = 0x0004
+ALG_SHA256 = 0x000B
+EFI_GLOBAL = "8be4df61-93ca-11d2-aa0d-00e098032b8c"
+EFI_IMAGE_SEC_DB = "d719b2cb-3d3a-4596-a3bc-dad00e67656f"
+EFI_CERT_X509 = "a5c059a1-94e4-4aa7-87b5-ab155c2bf072"
+FV_VOL = "12345678-1234-1234-1234-123456789abc"
+FV_FILE = "abcdef01-2345-6789-abcd-ef0123456789"
+
+
+def pack_guid(guid):
+    return uuid.UUID(guid).bytes_le
+
+
+def spec_id_event():
+    """SHA1-format header carrying a sha1+sha256 Spec ID."""
+    body = b"Spec ID Event03\x00" + struct.pack(
+        "<IBBBBI", 0, 0, 2, 0, 2, 2,
+    )
+    body += struct.pack("<HH", ALG_SHA1, 20)
+    body += struct.pack("<HH", ALG_SHA256, 32)
+    body += b"\x00"
+    return struct.pack(
+        "<II20sI", 0, 3, b"\x00" * 20, len(body),
+    ) + body
+
+
+def tcg_event(pcr, event_type, data, sha256=None):
+    """Crypto-agile TCG_PCR_EVENT2 with sha1+sha256 digests."""
+    if sha256 is None:
+        sha256 = hashlib.sha256(data).digest()
+    return (
+        struct.pack("<III", pcr, event_type, 2)
+        + struct.pack("<H", ALG_SHA1)
+        + hashlib.sha1(data).digest()
+        + struct.pack("<H", ALG_SHA256)
+        + sha256
+        + struct.pack("<I", len(data))
+        + data
+    )
+
+
+def efi_variable(guid, name, data):
+    return (
+        pack_guid(guid)
+        + struct.pack("<QQ", len(name), len(data))
+        + name.encode("utf-16-le")
+        + data
+    )
+
+
+def signature_list(sig_type, owner, sig_data):
+    sig_size = 16 + len(sig_data)
+    return (
+        pack_guid(sig_type)
+        + struct.pack("<III", 28 + sig_size, 0, sig_size)
+        + pack_guid(owner)
+        + sig_data
+    )
+
+
+def device_path_node(dp_type, subtype, body):
+    return struct.pack(
+        "<BBH", dp_type, subtype, 4 + len(body),
+    ) + body
+
+
+DP_END = device_path_node(0x7F, 0xFF, b"")
+
+
+def image_load_event(device_path):
+    return struct.pack(
+        "<QQQQ", 0x7E000000, 0x1000, 0, len(device_path),
+    ) + device_path
+
+
+def binary_log(*events):
+    return spec_id_event() + b"".join(events)
+
+
 class TestEventToSha256:
     def test_extracts_sha256(self):
         ev = make_event(0, "EV_S_CRTM_VERSION", DIGEST_AA)
@@ -334,6 +476,84 @@ class TestReplayPcrs:
         ).hexdigest()
         assert pcrs[11] == expected
 
+def phase_event(word):
+    return {
+        "PCRIndex": 11,
+        "Digests": [{
+            "AlgorithmId": "sha256",
+            "Digest": hashlib.sha256(word.encode()).hexdigest(),
+        }],
+    }
+
+
+class TestFindPcrDivergence:
+    events = [
+        make_event(0, "EV_S_CRTM_VERSION", DIGEST_AA),
+        make_event(11, "EV_IPL", DIGEST_AA),
+        make_event(11, "EV_IPL", DIGEST_BB),
+    ]
+    userspace = [phase_event("enter-initrd"), phase_event("leave-initrd")]
+
+    def test_match(self):
+        tpm = replay_pcrs(self.events, self.userspace)
+        assert find_pcr_divergence(self.events, self.userspace, tpm) == {}
+
+    def test_extra_userspace(self):
+        tpm = replay_pcrs(self.events, self.userspace[:1])
+        div = find_pcr_divergence(self.events, self.userspace, tpm)
+        assert list(div) == [11]
+        assert div[11]["verdict"] == "extra"
+        assert div[11]["matched"] == 3
+        assert div[11]["extends"] == 4
+        assert div[11]["last_matched"] == {
+            "source": "userspace", "index": 0, "type": None,
+        }
+        assert div[11]["first_extra"]["index"] == 1
+
+    def test_extra_eventlog(self):
+        tpm = replay_pcrs(self.events[:2])
+        div = find_pcr_divergence(self.events, (), tpm)
+        assert div[11]["matched"] == 1
+        assert div[11]["first_extra"] == {
+            "source": "eventlog", "index": 2, "type": "EV_IPL",
+        }
+
+    def test_never_extended(self):
+        tpm = {11: "00" * 32}
+        div = find_pcr_divergence(self.events, (), tpm)
+        assert div[11]["matched"] == 0
+        assert div[11]["last_matched"] is None
+
+    def test_missing_trailing(self):
+        full = self.userspace + [phase_event("sysinit"), phase_event("ready")]
+        tpm = replay_pcrs(self.events, full)
+        div = find_pcr_divergence(self.events, self.userspace, tpm)
+        assert div[11]["verdict"] == "missing"
+        assert div[11]["missing"] == ["sysinit", "ready"]
+
+    def test_diverged(self):
+        corrupted = [phase_event("enter-initrd"), phase_event("bogus")]
+        tpm = replay_pcrs(self.events, self.userspace)
+        div = find_pcr_divergence(self.events, corrupted, tpm)
+        assert div[11]["verdict"] == "diverged"
+        assert 0 not in div
+
+    def test_native_events(self, tmp_path):
+        path = tmp_path / "log"
+        path.write_bytes(
+            spec_id_event() + tcg_event(11, 0x0D, b"a")
+            + tcg_event(11, 0x0D, b"b")
+        )
+        events = list(iter_events(str(path)))
+        tpm = replay_pcrs(events[:-1])
+        div = find_pcr_divergence(events, None, tpm)
+        assert div[11]["matched"] == 1
+        assert div[11]["first_extra"] == {
+            "source": "eventlog", "index": len(events) - 1,
+            "type": "EV_IPL",
+        }
+
+
 class TestCreateRefstate:
     def test_has_required_keys(self):
         events = [
@@ -391,6 +611,73 @@ class TestCreateRefstate:
             "algorithm": "sha256",
         }
 
+    def test_from_bytes(self, tmp_path):
+        log = TestParseEventlogNative()._sample_log()
+        path = tmp_path / "log.bin"
+        path.write_bytes(log)
+        expected = create_refstate(parse_eventlog(
+            str(path), backend="native",
+        )["events"])
+        assert refstate_from_bytes(log) == expected
+        assert refstate_from_bytes(gzip.compress(log)) == expected
+        with pytest.raises(ValueError):
+            refstate_from_bytes(log[:-3])
+        with pytest.raises(ValueError, match="gzip"):
+            refstate_from_bytes(gzip.compress(log)[:-8])
+
+    def test_single_pass_matches_extractors(self):
+        """The fused pass yields exactly what the individual
+        get_* extractors produce, including the first-SCRTM,
+        any-PCR firmware and PCR-4-only UKI rules."""
+        fw_dp = (
+            "FvVol(12345678-1234-1234-1234-123456789abc)"
+            "/FvFile(abcdef01-2345-6789-abcd-ef0123456789)"
+        )
+        events = [
+            make_event(0, "EV_S_CRTM_VERSION", DIGEST_AA),
+            make_event(0, "EV_S_CRTM_VERSION", DIGEST_BB),
+            make_event(
+                0, "EV_EFI_PLATFORM_FIRMWARE_BLOB", DIGEST_BB,
+            ),
+            make_event(
+                2, "EV_EFI_PLATFORM_FIRMWARE_BLOB2", DIGEST_CC,
+            ),
+            make_event(
+                30, "EV_EFI_PLATFORM_FIRMWARE_BLOB", DIGEST_AA,
+            ),
+            {
+                "PCRIndex": 7,
+                "EventType": "EV_EFI_VARIABLE_DRIVER_CONFIG",
+                "Event": {
+                    "UnicodeName": "dbx",
+                    "VariableData": [{
+                        "Keys": [
+                            {
+                                "SignatureOwner": "o",
+                                "SignatureData": f"{i:02x}",
+                            }
+                            for i in range(5)
+                        ],
+                    }],
+                },
+            },
+            make_fw_app(2, DIGEST_AA),
+            make_fw_app(4, DIGEST_BB, device_path=fw_dp),
+            make_fw_app(4, DIGEST_CC),
+        ]
+        expected = {
+            "scrtm_and_bios": [{
+                **get_scrtm(events),
+                **get_platform_firmware(events),
+            }],
+            **get_keys(events),
+            "uki_digest": get_uki_digest(events),
+        }
+        assert json.dumps(create_refstate(iter(events))) == (
+            json.dumps(expected)
+        )
+
+
 class TestDiffRefstates:
     def _make_rs(self, uki="aa" * 32):
         return {
@@ -413,3 +700,1439 @@ class TestDiffRefstates:
         new = self._make_rs("bb" * 32)
         diff = diff_refstates(old, new)
         assert diff["uki_digest"] is not None
+
+    def test_ignores_representation(self):
+        old = self._make_rs()
+        old["db"] = [
+            {"SignatureOwner": "b", "SignatureData": "0xbb"},
+            {"SignatureOwner": "a", "SignatureData": "0xaa"},
+        ]
+        new = self._make_rs()
+        new["uki_digest"] = {"sha256": "AA" * 32}
+        new["db"] = [
+            {"SignatureOwner": "b", "SignatureData": "bb"},
+            {"SignatureOwner": "A", "SignatureData": "0xAA"},
+        ]
+        diff = diff_refstates(old, new)
+        assert all(v is None for v in diff.values())
+
+    def test_sig_list_reordered(self):
+        sigs = [
+            {"SignatureOwner": "a", "SignatureData": f"0x0{i}"}
+            for i in range(4)
+        ]
+        old = self._make_rs()
+        old["db"] = sigs
+        new = self._make_rs()
+        new["db"] = [sigs[3]] + sigs[:3]
+        diff = diff_refstates(old, new)
+        assert diff["db"] == {
+            "added": [],
+            "moved": [{
+                "SignatureOwner": "a", "SignatureData": "0x03",
+                "old_index": 3, "new_index": 0,
+            }],
+            "removed": [],
+            "duplicates": [],
+        }
+        assert diff["uki_digest"] is None
+
+    def test_sig_list_minimal_moves(self):
+        sigs = [
+            {"SignatureOwner": "a", "SignatureData": f"0x{i:04x}"}
+            for i in range(1000)
+        ]
+        old = self._make_rs()
+        old["dbx"] = sigs + [sigs[0]]
+        new = self._make_rs()
+        new["dbx"] = sigs[1:] + [sigs[0], sigs[0]]
+        moved = diff_refstates(old, new)["dbx"]["moved"]
+        assert [(m["old_index"], m["new_index"]) for m in moved] == [
+            (0, 999),
+        ]
+
+    def _with_fw(self, digests):
+        rs = self._make_rs()
+        rs["scrtm_and_bios"][0]["platform_firmware"] = [
+            {"sha256": f"0x{d}"} for d in digests
+        ]
+        return rs
+
+    def test_firmware_positions(self):
+        old = self._with_fw([DIGEST_AA, DIGEST_BB, DIGEST_CC])
+        new = self._with_fw(["dd" * 32, DIGEST_AA, DIGEST_CC])
+        fw = diff_refstates(old, new)["platform_firmware"]
+        assert fw["added"] == [{"index": 0, "sha256": "0x" + "dd" * 32}]
+        assert fw["removed"] == [{"index": 1, "sha256": f"0x{DIGEST_BB}"}]
+        assert fw["moved"] == []
+
+    def test_firmware_moved_and_duplicated(self):
+        old = self._with_fw([DIGEST_AA, DIGEST_BB, DIGEST_CC])
+        new = self._with_fw([DIGEST_CC, DIGEST_AA, DIGEST_BB, DIGEST_BB])
+        fw = diff_refstates(old, new)["platform_firmware"]
+        assert fw["moved"] == [{
+            "sha256": f"0x{DIGEST_CC}", "old_index": 2, "new_index": 0,
+        }]
+        assert fw["added"] == [{"index": 3, "sha256": f"0x{DIGEST_BB}"}]
+        assert fw["removed"] == []
+        assert fw["duplicates"] == [{
+            "sha256": f"0x{DIGEST_BB}",
+            "old_indices": [1],
+            "new_indices": [2, 3],
+        }]
+
+    def test_sig_list_multiset(self):
+        sig = {"SignatureOwner": "a", "SignatureData": "0x01"}
+        old = self._make_rs()
+        old["dbx"] = [sig, {"SignatureOwner": "a", "SignatureData": "0x02"}]
+        new = self._make_rs()
+        new["dbx"] = [
+            {"SignatureOwner": "A", "SignatureData": "0x03"},
+            sig, sig,
+        ]
+        dbx = diff_refstates(old, new)["dbx"]
+        assert dbx["added"] == [
+            {"index": 0, "SignatureOwner": "a", "SignatureData": "0x03"},
+            {"index": 2, "SignatureOwner": "a", "SignatureData": "0x01"},
+        ]
+        assert dbx["removed"] == [
+            {"index": 1, "SignatureOwner": "a", "SignatureData": "0x02"},
+        ]
+        assert dbx["duplicates"] == [{
+            "SignatureOwner": "a", "SignatureData": "0x01",
+            "old_indices": [0], "new_indices": [1, 2],
+        }]
+
+    def test_large_dbx(self):
+        sigs = [
+            {"SignatureOwner": "a", "SignatureData": f"0x{i:064x}"}
+            for i in range(20000)
+        ]
+        old = self._make_rs()
+        old["dbx"] = sigs
+        new = self._make_rs()
+        new["dbx"] = sigs[1:] + [
+            {"SignatureOwner": "a", "SignatureData": "0x" + "ff" * 32},
+        ]
+        dbx = diff_refstates(old, new)["dbx"]
+        assert [s["index"] for s in dbx["added"]] == [19999]
+        assert [s["index"] for s in dbx["removed"]] == [0]
+
+
+class TestAlignSequences:
+    def test_identical(self):
+        a = align_sequences([1, 2, 3], [1, 2, 3])
+        assert a["matched"] == [(0, 0), (1, 1), (2, 2)]
+        assert a["moved"] == a["added"] == a["removed"] == []
+
+    def test_insert_and_move(self):
+        a = align_sequences([1, 2, 3, 4], [4, 1, 2, 5, 3])
+        assert a["moved"] == [(3, 0)]
+        assert a["added"] == [3]
+        assert a["removed"] == []
+        assert sorted(a["matched"]) == [(0, 1), (1, 2), (2, 4)]
+
+
+def pe_image(sections):
+    """A minimal PE image with the given (name, data) sections."""
+    pe_off = 0x40
+    table = pe_off + 24
+    raw_off = table + 40 * len(sections)
+    headers = b""
+    body = b""
+    for name, data in sections:
+        headers += struct.pack(
+            "<8sIIII16x",
+            name.encode(), len(data), 0x1000,
+            len(data) + 3, raw_off + len(body),
+        )
+        body += data + b"\xff" * 3
+    dos = b"MZ" + bytes(0x3A) + struct.pack("<I", pe_off)
+    coff = b"PE\0\0" + struct.pack(
+        "<HHIIIHH", 0x8664, len(sections), 0, 0, 0, 0, 0,
+    )
+    return dos + coff + headers + body
+
+
+def extend(value, data):
+    return hashlib.sha256(value + hashlib.sha256(data).digest()).digest()
+
+
+class TestPredictPcr11:
+    UKI = pe_image([
+        (".text", b"stub code"),
+        (".cmdline", b"console=ttyS0"),
+        (".linux", b"kernel image"),
+        (".pcrsig", b"{}"),
+        (".osrel", b"ID=nixos\n"),
+    ])
+
+    def test_sections(self):
+        sections = uki_sections(self.UKI)
+        assert sections[".linux"] == b"kernel image"
+        assert list(sections) == [
+            ".text", ".cmdline", ".linux", ".pcrsig", ".osrel",
+        ]
+
+    def test_events_in_stub_order(self):
+        events = uki_pcr11_events(self.UKI)
+        assert [e["Event"]["String"] for e in events] == [
+            ".linux", ".linux", ".osrel", ".osrel",
+            ".cmdline", ".cmdline",
+        ]
+        assert all(e["EventType"] == "EV_IPL" for e in events)
+
+    def test_predict(self, tmp_path):
+        value = bytes(32)
+        for data in (
+            b".linux\0", b"kernel image",
+            b".osrel\0", b"ID=nixos\n",
+            b".cmdline\0", b"console=ttyS0",
+        ):
+            value = extend(value, data)
+        assert predict_pcr11(self.UKI) == {"sha256": value.hex()}
+        for word in PCRPHASE_BOOTED:
+            value = extend(value, word.encode())
+        path = tmp_path / "uki.efi"
+        path.write_bytes(self.UKI)
+        predicted = predict_pcr11(
+            str(path), PCRPHASE_BOOTED, ("sha1", "sha256"),
+        )
+        assert predicted["sha256"] == value.hex()
+        assert len(predicted["sha1"]) == 40
+
+    def test_matches_replay(self):
+        events = uki_pcr11_events(self.UKI, PCRPHASE_BOOTED)
+        assert replay_pcrs(events)[11] == predict_pcr11(
+            self.UKI, PCRPHASE_BOOTED,
+        )["sha256"]
+
+    def test_rejects_non_pe(self):
+        with pytest.raises(ValueError):
+            uki_pcr11_events(b"not a PE file")
+        with pytest.raises(ValueError):
+            uki_pcr11_events(pe_image([(".profile", b"ID=a")]))
+
+class TestCanonicalRefstate:
+    def _make_rs(self):
+        return {
+            "scrtm_and_bios": [{
+                "scrtm": {"sha256": f"0x{DIGEST_AA}"},
+                "platform_firmware": [
+                    {"sha256": f"0x{DIGEST_BB}"},
+                    {"sha256": f"0x{DIGEST_CC}"},
+                ],
+            }],
+            "pk": [],
+            "kek": [],
+            "db": [
+                {"SignatureOwner": "b", "SignatureData": "0x02"},
+                {"SignatureOwner": "a", "SignatureData": "0x01"},
+            ],
+            "dbx": [],
+            "uki_digest": {"sha256": f"0x{DIGEST_CC}"},
+            "userspace_digests": [
+                {"pcr": 11, "digest": DIGEST_BB, "algorithm": "sha256"},
+                {"pcr": 11, "digest": DIGEST_AA, "algorithm": "sha256"},
+            ],
+        }
+
+    def test_normalises_hex_and_sorts_sigs(self):
+        rs = self._make_rs()
+        rs["uki_digest"] = {"SHA256": DIGEST_CC.upper()}
+        rs["db"][1]["SignatureData"] = "0X01"
+        canon = canonicalize_refstate(rs)
+        assert canon["uki_digest"] == {"sha256": f"0x{DIGEST_CC}"}
+        assert canon["db"] == [
+            {"SignatureOwner": "a", "SignatureData": "0x01"},
+            {"SignatureOwner": "b", "SignatureData": "0x02"},
+        ]
+        assert canon == canonicalize_refstate(self._make_rs())
+        assert canonicalize_refstate(canon) == canon
+
+    def test_keeps_measurement_order(self):
+        canon = canonicalize_refstate(self._make_rs())
+        fw = canon["scrtm_and_bios"][0]["platform_firmware"]
+        assert fw == [
+            {"sha256": f"0x{DIGEST_BB}"},
+            {"sha256": f"0x{DIGEST_CC}"},
+        ]
+        assert [
+            d["digest"] for d in canon["userspace_digests"]
+        ] == [DIGEST_BB, DIGEST_AA]
+
+    def test_digest(self):
+        rs = self._make_rs()
+        shuffled = self._make_rs()
+        shuffled["db"].reverse()
+        shuffled["uki_digest"]["sha256"] = shuffled[
+            "uki_digest"
+        ]["sha256"].upper().replace("0X", "0x")
+        assert refstate_digest(rs) == refstate_digest(shuffled)
+        fw = shuffled["scrtm_and_bios"][0]["platform_firmware"]
+        fw.reverse()
+        assert refstate_digest(rs) != refstate_digest(shuffled)
+        assert len(refstate_digest(rs)) == 64
+
+    def test_does_not_mutate(self):
+        rs = self._make_rs()
+        canonicalize_refstate(rs)
+        assert rs == self._make_rs()
+
+
+class TestCompactRefstate:
+    def _make_rs(self, uki=DIGEST_CC):
+        return canonicalize_refstate({
+            "scrtm_and_bios": [{
+                "scrtm": {"sha256": f"0x{DIGEST_AA}"},
+                "platform_firmware": [{"sha256": f"0x{DIGEST_BB}"}],
+            }],
+            "pk": [{"SignatureOwner": "a", "SignatureData": "0x01"}],
+            "kek": [],
+            "db": [{"SignatureOwner": "a", "SignatureData": "0x02"}],
+            "dbx": [
+                {"SignatureOwner": "b", "SignatureData": f"0x{i:064x}"}
+                for i in range(500)
+            ],
+            "uki_digest": {"sha256": f"0x{uki}"},
+        })
+
+    def test_round_trip(self):
+        sets = {}
+        rs = self._make_rs()
+        compact = compact_refstate(rs, sets)
+        assert compact["dbx"] == {
+            "signature_set": signature_set_digest(rs["dbx"]),
+            "count": 500,
+        }
+        assert compact["kek"] == []
+        assert len(json.dumps(compact)) * 10 < len(json.dumps(rs))
+        assert expand_refstate(compact, sets) == rs
+        assert expand_refstate(rs, sets) == rs
+
+    def test_sets_are_shared(self):
+        sets = {}
+        compact_refstate(self._make_rs(), sets)
+        compact_refstate(self._make_rs(DIGEST_AA), sets)
+        assert len(sets) == 3
+
+    def test_missing_set(self):
+        compact = compact_refstate(self._make_rs(), {})
+        sets = {}
+        assert missing_signature_sets(compact, sets) == [
+            compact[k]["signature_set"] for k in ("pk", "db", "dbx")
+        ]
+        with pytest.raises(KeyError):
+            expand_refstate(compact, sets)
+
+    def test_store(self, tmp_path):
+        store = SignatureSetStore(str(tmp_path / "sets"))
+        rs = self._make_rs()
+        compact = compact_refstate(rs, store)
+        assert len(store) == 3
+        assert expand_refstate(compact, store) == rs
+        assert missing_signature_sets(compact, store) == []
+
+    def test_store_rejects_mismatch(self, tmp_path):
+        store = SignatureSetStore(str(tmp_path))
+        sigs = [{"SignatureOwner": "a", "SignatureData": "0x01"}]
+        with pytest.raises(ValueError):
+            store["00" * 32] = sigs
+        digest = signature_set_digest(sigs)
+        store[digest] = sigs
+        (tmp_path / f"{digest}.json").write_text("[]")
+        assert digest in store
+        with pytest.raises(KeyError):
+            store[digest]
+        with pytest.raises(KeyError):
+            store["../etc/passwd"]
+
+class TestRefstateIndex:
+    def _make_rs(self, fw, dbx):
+        return {
+            "scrtm_and_bios": [{
+                "scrtm": {"sha256": f"0x{DIGEST_AA}"},
+                "platform_firmware": [{"sha256": f"0x{d}"} for d in fw],
+            }],
+            "pk": [], "kek": [], "db": [],
+            "dbx": [
+                {"SignatureOwner": "a", "SignatureData": f"0x{d}"}
+                for d in dbx
+            ],
+            "uki_digest": {"sha256": f"0x{DIGEST_CC}"},
+        }
+
+    @pytest.fixture
+    def index(self, tmp_path):
+        with RefstateIndex(str(tmp_path / "index.sqlite")) as index:
+            index.add_many([
+                ("agent-1", self._make_rs([DIGEST_BB], ["01"])),
+                ("agent-2", self._make_rs([DIGEST_BB], ["01", "02"])),
+                ("agent-3", self._make_rs([DIGEST_CC], ["01", "02"])),
+            ])
+            yield index
+
+    def test_agents_with(self, index):
+        assert index.agents_with(f"0x{DIGEST_BB}") == ["agent-1", "agent-2"]
+        assert index.agents_with(DIGEST_CC.upper()) == [
+            "agent-1", "agent-2", "agent-3",
+        ]
+        assert index.agents_with(
+            f"0x{DIGEST_CC}", "platform_firmware",
+        ) == ["agent-3"]
+
+    def test_agents_without(self, index):
+        assert index.agents_without("0x02", "dbx") == ["agent-1"]
+
+    def test_variants(self, index):
+        dbx = index.variants("dbx")
+        assert [agents for _, agents in dbx] == [
+            ["agent-2", "agent-3"], ["agent-1"],
+        ]
+        assert len(index.variants()) == 3
+
+    def test_reindex_and_remove(self, index):
+        index.add("agent-1", self._make_rs([DIGEST_BB], ["01", "02"]))
+        assert index.agents_without("0x02", "dbx") == []
+        assert index.components("agent-1")["dbx"] == ["0x01", "0x02"]
+        index.remove("agent-2")
+        assert index.agents() == ["agent-1", "agent-3"]
+        assert index.agents_with(f"0x{DIGEST_BB}") == ["agent-1"]
+
+class TestParseEventlogNative:
+    def _write(self, tmp_path, data):
+        path = tmp_path / "binary_bios_measurements"
+        path.write_bytes(data)
+        return str(path)
+
+    def _sample_log(self):
+        fw_path = (
+            device_path_node(0x04, 0x07, pack_guid(FV_VOL))
+            + device_path_node(0x04, 0x06, pack_guid(FV_FILE))
+            + DP_END
+        )
+        uki_path = (
+            device_path_node(
+                0x04, 0x04,
+                "\\EFI\\BOOT\\BOOTX64.EFI\x00".encode(
+                    "utf-16-le",
+                ),
+            )
+            + DP_END
+        )
+        return binary_log(
+            tcg_event(
+                0, 0x8, b"", sha256=bytes.fromhex(DIGEST_AA),
+            ),
+            tcg_event(
+                0, 0x80000008,
+                struct.pack("<QQ", 0xFF000000, 0x1000),
+                sha256=bytes.fromhex(DIGEST_BB),
+            ),
+            tcg_event(
+                7, 0x80000001,
+                efi_variable(EFI_GLOBAL, "SecureBoot", b"\x01"),
+            ),
+            tcg_event(
+                7, 0x80000001,
+                efi_variable(
+                    EFI_IMAGE_SEC_DB, "db",
+                    signature_list(
+                        EFI_CERT_X509, FV_VOL, b"\xab" * 8,
+                    ),
+                ),
+            ),
+            tcg_event(4, 0x80000003, image_load_event(fw_path)),
+            tcg_event(
+                4, 0x80000007,
+                b"Calling EFI Application from Boot Option",
+            ),
+            tcg_event(
+                4, 0x80000003, image_load_event(uki_path),
+                sha256=bytes.fromhex(DIGEST_CC),
+            ),
+            tcg_event(4, 0x4, b"\x00" * 4),
+        )
+
+    def test_schema(self, tmp_path):
+        log = parse_eventlog(
+            self._write(tmp_path, self._sample_log()),
+            backend="native",
+        )
+        events = log["events"]
+        assert events[0]["EventType"] == "EV_NO_ACTION"
+        assert events[0]["SpecID"][0]["numberOfAlgorithms"] == 2
+        scrtm = events[1]
+        assert scrtm["PCRIndex"] == 0
+        assert scrtm["EventType"] == "EV_S_CRTM_VERSION"
+        assert [d["AlgorithmId"] for d in scrtm["Digests"]] == [
+            "sha1", "sha256",
+        ]
+        assert event_to_sha256(scrtm) == {
+            "sha256": f"0x{DIGEST_AA}",
+        }
+        assert events[2]["Event"] == {
+            "BlobBase": 0xFF000000, "BlobLength": 0x1000,
+        }
+
+    def test_event_bodies(self, tmp_path):
+        events = parse_eventlog(
+            self._write(tmp_path, self._sample_log()),
+            backend="native",
+        )["events"]
+        sb = events[3]["Event"]
+        assert sb["VariableName"] == EFI_GLOBAL
+        assert sb["UnicodeName"] == "SecureBoot"
+        assert sb["VariableData"] == {"Enabled": "Yes"}
+        db = events[4]["Event"]["VariableData"]
+        assert db[0]["SignatureType"] == EFI_CERT_X509
+        assert events[5]["Event"]["DevicePath"] == (
+            f"FvVol({FV_VOL})/FvFile({FV_FILE})"
+        )
+        assert events[6]["Event"] == (
+            "Calling EFI Application from Boot Option"
+        )
+        assert events[7]["Event"]["DevicePath"] == (
+            "File(\\EFI\\BOOT\\BOOTX64.EFI)"
+        )
+        assert events[8]["EventType"] == "EV_SEPARATOR"
+        assert events[8]["Event"] == "00000000"
+
+    def test_refstate_from_native_log(self, tmp_path):
+        events = parse_eventlog(
+            self._write(tmp_path, self._sample_log()),
+            backend="native",
+        )["events"]
+        rs = create_refstate(events)
+        assert rs["scrtm_and_bios"] == [{
+            "scrtm": {"sha256": f"0x{DIGEST_AA}"},
+            "platform_firmware": [
+                {"sha256": f"0x{DIGEST_BB}"},
+            ],
+        }]
+        assert rs["db"] == [{
+            "SignatureOwner": FV_VOL,
+            "SignatureData": "0x" + "ab" * 8,
+        }]
+        assert rs["uki_digest"] == {"sha256": f"0x{DIGEST_CC}"}
+
+    @pytest.mark.parametrize("pcr,event_type,body", [
+        (7, 0x80000001, efi_variable(
+            EFI_IMAGE_SEC_DB, "db",
+            signature_list(EFI_CERT_X509, FV_VOL, b"\xab" * 8),
+        )[:10]),
+        (7, 0x80000001, efi_variable(
+            EFI_IMAGE_SEC_DB, "db",
+            signature_list(EFI_CERT_X509, FV_VOL, b"\xab" * 8),
+        )[:-5]),
+        (7, 0x800000E0, efi_variable(
+            EFI_IMAGE_SEC_DB, "db", b"\x00" * 8,
+        )[:20]),
+        (1, 0x80000002, efi_variable(
+            EFI_GLOBAL, "Boot0001", b"\x01\x00\x00\x00",
+        )[:-2]),
+        (4, 0x80000003, image_load_event(DP_END)[:8]),
+        (2, 0x80000004, image_load_event(DP_END)[:8]),
+        (2, 0x80000005, image_load_event(DP_END)[:8]),
+        (0, 0x8000000A, b"\x05ab"),
+        (0, 0x80000008, b"\x00" * 8),
+    ], ids=[
+        "db-header", "db-signature-list", "authority", "boot",
+        "application", "driver", "runtime-driver", "blob2", "blob",
+    ])
+    def test_truncated_body(self, tmp_path, pcr, event_type, body):
+        # Undecodable bodies are kept as hex; refstate creation
+        # must not trip over them.
+        events = parse_eventlog(
+            self._write(tmp_path, binary_log(
+                tcg_event(0, 0x8, b""),
+                tcg_event(pcr, event_type, body),
+            )),
+            backend="native",
+        )["events"]
+        assert events[2]["Event"] == body.hex()
+        rs = create_refstate(events)
+        assert rs["pk"] == rs["db"] == []
+
+    def test_truncated_log(self, tmp_path):
+        data = self._sample_log()[:-3]
+        assert parse_eventlog(
+            self._write(tmp_path, data), backend="native",
+        ) is None
+
+    def test_not_crypto_agile(self, tmp_path):
+        data = struct.pack("<II20sI", 0, 3, b"\x00" * 20, 4)
+        data += b"\x00" * 4
+        assert parse_eventlog(
+            self._write(tmp_path, data), backend="native",
+        ) is None
+
+    def test_unknown_backend(self, tmp_path):
+        path = self._write(tmp_path, self._sample_log())
+        assert parse_eventlog(path, backend="bogus") is None
+
+
+class TestIterEvents:
+    LOG = binary_log(
+        tcg_event(0, 0x8, b"", sha256=bytes.fromhex(DIGEST_AA)),
+        tcg_event(4, 0x4, b"\x00" * 4),
+    )
+
+    def test_from_path(self, tmp_path):
+        path = tmp_path / "log.bin"
+        path.write_bytes(self.LOG)
+        events = list(iter_events(str(path)))
+        assert [e["EventNum"] for e in events] == [0, 1, 2]
+        assert events[1]["EventType"] == "EV_S_CRTM_VERSION"
+
+    def test_from_stream_is_lazy(self):
+        it = iter_events(io.BytesIO(self.LOG + b"\x01"))
+        assert next(it)["EventType"] == "EV_NO_ACTION"
+        assert next(it)["EventType"] == "EV_S_CRTM_VERSION"
+        assert next(it)["EventType"] == "EV_SEPARATOR"
+        with pytest.raises(ValueError, match="truncated"):
+            next(it)
+
+    def test_truncated_spec_id(self):
+        # Declares two banks but only describes one.
+        body = b"Spec ID Event03\x00" + struct.pack(
+            "<IBBBBI", 0, 0, 2, 0, 2, 2,
+        ) + struct.pack("<HH", ALG_SHA256, 32)
+        data = struct.pack(
+            "<II20sI", 0, 3, b"\x00" * 20, len(body),
+        ) + body
+        with pytest.raises(ValueError, match="truncated Spec ID"):
+            list(iter_events(io.BytesIO(data)))
+
+    def test_gzip(self, tmp_path):
+        path = tmp_path / "log.bin.gz"
+        path.write_bytes(gzip.compress(self.LOG))
+        assert len(list(iter_events(str(path)))) == 3
+
+    def test_concatenated_logs(self):
+        events = list(iter_events(io.BytesIO(self.LOG * 2)))
+        assert [e["EventNum"] for e in events] == [
+            0, 1, 2, 0, 1, 2,
+        ]
+        assert "SpecID" in events[3]
+
+    def test_empty(self):
+        with pytest.raises(ValueError, match="empty"):
+            list(iter_events(io.BytesIO(b"")))
+
+
+class TestStreamingConsumers:
+    def test_iter_userspace_events(self, tmp_path):
+        log = tmp_path / "tpm2-measure.log"
+        record = {
+            "pcr": 11,
+            "digests": [{
+                "hashAlg": "sha256", "digest": DIGEST_AA,
+            }],
+        }
+        log.write_text(f"\x1e{json.dumps(record)}\n" * 3)
+        it = iter_userspace_events(str(log))
+        assert next(it)["PCRIndex"] == 11
+        assert len(list(it)) == 2
+
+    def test_iter_userspace_events_missing(self):
+        assert list(iter_userspace_events("/nonexistent")) == []
+
+    def test_replay_pcrs_accepts_iterators(self):
+        events = [
+            make_event(0, "EV_S_CRTM_VERSION", DIGEST_AA),
+            make_event(9, "EV_EVENT_TAG", DIGEST_BB),
+        ]
+        userspace = [{
+            "PCRIndex": 9,
+            "Digests": [{
+                "AlgorithmId": "sha256", "Digest": DIGEST_CC,
+            }],
+        }]
+        assert replay_pcrs(
+            iter(events), iter(userspace),
+        ) == replay_pcrs(events, userspace)
+
+    def test_replay_events_single_pass(self):
+        events = [
+            make_event(0, "EV_S_CRTM_VERSION", DIGEST_AA),
+            make_event(
+                0, "EV_EFI_PLATFORM_FIRMWARE_BLOB",
+                DIGEST_BB,
+            ),
+            make_separator(4),
+            make_fw_app(4, DIGEST_CC),
+        ]
+        pcrs = {}
+        rs = create_refstate(
+            replay_events(iter(events), pcrs),
+        )
+        assert rs == create_refstate(events)
+        assert {
+            idx: v.hex() for idx, v in pcrs.items()
+        } == replay_pcrs(events)
+
+
+class TestEvent:
+    LOG = TestParseEventlogNative()._sample_log()
+
+    def _events(self):
+        return list(iter_events(io.BytesIO(self.LOG)))[1:]
+
+    def test_slots(self):
+        ev = self._events()[0]
+        assert isinstance(ev, Event)
+        assert not hasattr(ev, "__dict__")
+        assert ev.pcr == 0
+        assert ev.type == "EV_S_CRTM_VERSION"
+        assert ev.digests["sha256"] == bytes.fromhex(DIGEST_AA)
+
+    def test_body_decoded_lazily(self, monkeypatch):
+        calls = []
+        decode = measured_boot_state._decode_event_body
+
+        def counting(event_type, data):
+            calls.append(event_type)
+            return decode(event_type, data)
+
+        monkeypatch.setattr(
+            measured_boot_state, "_decode_event_body", counting,
+        )
+        events = self._events()
+        pcrs = replay_pcrs(events)
+        create_refstate(events)
+        assert pcrs
+        # Only variable config and application events have
+        # their bodies looked at by create_refstate.
+        assert set(calls) == {
+            "EV_EFI_VARIABLE_DRIVER_CONFIG",
+            "EV_EFI_BOOT_SERVICES_APPLICATION",
+        }
+        n = len(calls)
+        assert events[2].body is events[2]["Event"]
+        assert len(calls) == n
+
+    def test_mapping_compat(self):
+        ev = self._events()[0]
+        assert dict(ev) == {
+            "EventNum": 1,
+            "PCRIndex": 0,
+            "EventType": "EV_S_CRTM_VERSION",
+            "DigestCount": 2,
+            "Digests": [
+                {
+                    "AlgorithmId": "sha1",
+                    "Digest": hashlib.sha1(b"").hexdigest(),
+                },
+                {"AlgorithmId": "sha256", "Digest": DIGEST_AA},
+            ],
+            "EventSize": 0,
+            "Event": {"String": ""},
+        }
+        assert ev.get("Missing", 1) == 1
+        json.dumps(dict(ev))
+
+    def test_same_results_as_dicts(self):
+        events = self._events()
+        dicts = [dict(ev) for ev in events]
+        assert replay_pcrs(events) == replay_pcrs(dicts)
+        assert create_refstate(events) == create_refstate(dicts)
+        for ev, d in zip(events, dicts):
+            assert event_to_sha256(ev) == event_to_sha256(d)
+
+
+class TestPcrBank:
+    def _events(self):
+        return [
+            make_event(0, "EV_S_CRTM_VERSION", DIGEST_AA),
+            make_event(0, "EV_POST_CODE", DIGEST_BB),
+            make_event(9, "EV_EVENT_TAG", DIGEST_CC),
+        ]
+
+    def test_matches_replay_pcrs(self):
+        bank = PcrBank()
+        for ev in self._events():
+            bank.extend_event(ev)
+        assert bank.values() == replay_pcrs(self._events())
+        assert bank.value(0).hex() == bank.values()[0]
+        assert bank.value(5) == b"\x00" * 32
+
+    def test_multi_bank(self):
+        events = list(iter_events(io.BytesIO(
+            TestParseEventlogNative()._sample_log(),
+        )))
+        bank = PcrBank(("sha1", "sha256", "sha384"))
+        bank.update(events)
+        assert bank.values("sha256") == replay_pcrs(events)
+        assert bank.values("sha1") == replay_pcrs(
+            events, algorithm="sha1",
+        )
+        # The sample log only has sha1 and sha256 digests.
+        assert bank.values("sha384") == {}
+        expected = b"\x00" * 20
+        for ev in events[1:]:
+            if ev.pcr == 4:
+                expected = hashlib.sha1(
+                    expected + ev.digests["sha1"],
+                ).digest()
+        assert bank.values("sha1")[4] == expected.hex()
+
+    def test_incremental(self):
+        events = self._events()
+        bank = PcrBank()
+        bank.update(events[:2])
+        before = bank.values()
+        bank.update(events[2:])
+        assert before[0] == bank.values()[0]
+        assert bank.values() == replay_pcrs(events)
+
+    def test_snapshot_restore(self):
+        events = self._events()
+        bank = PcrBank(("sha256", "sha384"))
+        bank.update(events[:1])
+        snap = bank.snapshot()
+        bank.update(events[1:])
+        bank.extend(7, "sha384", b"\x11" * 48)
+        bank.restore(snap)
+        assert bank.values() == replay_pcrs(events[:1])
+        assert bank.values("sha384") == {}
+        bank.update(events[1:])
+        assert bank.values() == replay_pcrs(events)
+
+    def test_history(self):
+        bank = PcrBank()
+        bank.update(self._events())
+        hist = bank.history(0)
+        assert len(hist) == 2
+        assert hist[0].hex() == replay_pcrs(self._events()[:1])[0]
+        assert hist[-1] == bank.value(0)
+        assert bank.history(3) == []
+
+    def test_unsupported_bank(self):
+        with pytest.raises(ValueError, match="sm3_256"):
+            PcrBank(("sm3_256",))
+
+
+class TestEventlogCache:
+    LOG = TestParseEventlogNative()._sample_log()
+
+    def _write(self, tmp_path, data=None):
+        path = tmp_path / "binary_bios_measurements"
+        path.write_bytes(self.LOG if data is None else data)
+        return str(path)
+
+    def test_hit_skips_parsing(self, tmp_path, monkeypatch):
+        path = self._write(tmp_path)
+        cache = str(tmp_path / "cache")
+        first = parse_eventlog(path, "native", cache_dir=cache)
+        assert len(list((tmp_path / "cache").iterdir())) == 1
+
+        def fail(path):
+            raise AssertionError("parsed despite cache hit")
+
+        monkeypatch.setattr(
+            measured_boot_state, "_parse_eventlog_native", fail,
+        )
+        second = parse_eventlog(path, "native", cache_dir=cache)
+        assert second == first
+        assert create_refstate(second["events"]) == create_refstate(
+            first["events"],
+        )
+
+    def test_keyed_by_content(self, tmp_path):
+        cache = tmp_path / "cache"
+        path = self._write(tmp_path)
+        parse_eventlog(path, "native", cache_dir=str(cache))
+        self._write(tmp_path, binary_log(
+            tcg_event(0, 0x8, b"", sha256=bytes.fromhex(DIGEST_BB)),
+        ))
+        log = parse_eventlog(path, "native", cache_dir=str(cache))
+        assert event_to_sha256(log["events"][1]) == {
+            "sha256": f"0x{DIGEST_BB}",
+        }
+        assert len(list(cache.iterdir())) == 2
+
+    def test_stale_version_ignored(self, tmp_path):
+        cache = tmp_path / "cache"
+        path = self._write(tmp_path)
+        parse_eventlog(path, "native", cache_dir=str(cache))
+        (entry,) = cache.iterdir()
+        record = json.loads(entry.read_text())
+        record["cache_version"] = -1
+        record["log"]["events"] = []
+        entry.write_text(json.dumps(record))
+        log = parse_eventlog(path, "native", cache_dir=str(cache))
+        assert len(log["events"]) == 9
+
+    def test_corrupt_entry_reparsed(self, tmp_path):
+        cache = tmp_path / "cache"
+        path = self._write(tmp_path)
+        parse_eventlog(path, "native", cache_dir=str(cache))
+        (entry,) = cache.iterdir()
+        entry.write_text("{")
+        log = parse_eventlog(path, "native", cache_dir=str(cache))
+        assert len(log["events"]) == 9
+        assert json.loads(entry.read_text())["log"]["events"]
+
+    def test_eviction(self, tmp_path):
+        cache = tmp_path / "cache"
+        paths = []
+        for i in range(3):
+            path = tmp_path / f"log{i}"
+            path.write_bytes(binary_log(tcg_event(
+                0, 0x8, b"", sha256=bytes([i]) * 32,
+            )))
+            paths.append(str(path))
+        parse_eventlog(paths[0], "native", cache_dir=str(cache))
+        (entry,) = cache.iterdir()
+        os.utime(entry, (0, 0))
+        limit = entry.stat().st_size * 2
+        for path in paths[1:]:
+            parse_eventlog(
+                path, "native", cache_dir=str(cache),
+                cache_max_bytes=limit,
+            )
+        assert len(list(cache.iterdir())) == 2
+        assert not entry.exists()
+
+    def test_failed_parse_not_cached(self, tmp_path):
+        cache = tmp_path / "cache"
+        path = self._write(tmp_path, self.LOG[:-3])
+        assert parse_eventlog(
+            path, "native", cache_dir=str(cache),
+        ) is None
+        assert list(cache.iterdir()) == []
+
+    def test_same_type_on_hit_and_miss(self, tmp_path):
+        path = self._write(tmp_path)
+        cache = str(tmp_path / "cache")
+        first = parse_eventlog(path, "native", cache_dir=cache)
+        second = parse_eventlog(path, "native", cache_dir=cache)
+        for log in (first, second):
+            assert all(type(e) is dict for e in log["events"])
+        assert first == second
+
+    def test_disabled_by_env(self, tmp_path, monkeypatch):
+        cache = tmp_path / "cache"
+        path = self._write(tmp_path)
+        monkeypatch.setattr(measured_boot_state, "UEFI_EVENTLOG", path)
+        monkeypatch.setattr(
+            measured_boot_state, "EVENTLOG_CACHE_DIR", str(cache),
+        )
+        monkeypatch.setitem(
+            measured_boot_state._EVENTLOG_PARSERS, "tpm2_eventlog",
+            measured_boot_state._parse_eventlog_native,
+        )
+        parse_eventlog(path, "tpm2_eventlog")
+        assert not cache.exists()
+
+    def test_default_only_for_kernel_log(self, tmp_path, monkeypatch):
+        cache = tmp_path / "cache"
+        monkeypatch.delenv("MEASURED_BOOT_EVENTLOG_CACHE")
+        monkeypatch.setattr(
+            measured_boot_state, "EVENTLOG_CACHE_DIR", str(cache),
+        )
+        # Stands in for the tpm2_eventlog tool.
+        monkeypatch.setitem(
+            measured_boot_state._EVENTLOG_PARSERS, "tpm2_eventlog",
+            measured_boot_state._parse_eventlog_native,
+        )
+        path = self._write(tmp_path)
+        parse_eventlog(path, "tpm2_eventlog")
+        assert not cache.exists()
+        monkeypatch.setattr(measured_boot_state, "UEFI_EVENTLOG", path)
+        parse_eventlog(path, "tpm2_eventlog")
+        assert len(list(cache.iterdir())) == 1
+
+    def test_native_not_cached_by_default(self, tmp_path, monkeypatch):
+        cache = tmp_path / "cache"
+        monkeypatch.delenv("MEASURED_BOOT_EVENTLOG_CACHE")
+        monkeypatch.setattr(
+            measured_boot_state, "EVENTLOG_CACHE_DIR", str(cache),
+        )
+        path = self._write(tmp_path)
+        monkeypatch.setattr(measured_boot_state, "UEFI_EVENTLOG", path)
+        log = parse_eventlog(path, "native")
+        assert not cache.exists()
+        assert isinstance(log["events"][1], measured_boot_state.Event)
+
+
+def userspace_record(pcr, digest):
+    record = {
+        "pcr": pcr,
+        "digests": [{"hashAlg": "sha256", "digest": digest}],
+    }
+    return f"\x1e{json.dumps(record)}\n"
+
+
+class TestUserspaceLogReader:
+    def test_incremental(self, tmp_path):
+        log = tmp_path / "tpm2-measure.log"
+        log.write_text(userspace_record(9, DIGEST_AA))
+        reader = UserspaceLogReader(str(log))
+        assert len(reader.read_new()) == 1
+        assert reader.read_new() == []
+        with open(log, "a") as f:
+            f.write(userspace_record(11, DIGEST_BB))
+        (event,) = reader.read_new()
+        assert event["PCRIndex"] == 11
+        assert reader.offset == log.stat().st_size
+
+    def test_partial_record(self, tmp_path):
+        log = tmp_path / "tpm2-measure.log"
+        record = userspace_record(9, DIGEST_AA)
+        log.write_text(record[:10])
+        reader = UserspaceLogReader(str(log))
+        assert reader.read_new() == []
+        assert reader.offset == 0
+        with open(log, "a") as f:
+            f.write(record[10:])
+        assert len(reader.read_new()) == 1
+
+    def test_truncated_file_restarts(self, tmp_path):
+        log = tmp_path / "tpm2-measure.log"
+        log.write_text(userspace_record(9, DIGEST_AA) * 2)
+        reader = UserspaceLogReader(str(log))
+        assert len(reader.read_new()) == 2
+        log.write_text(userspace_record(11, DIGEST_BB))
+        (event,) = reader.read_new()
+        assert event["PCRIndex"] == 11
+
+    def test_missing_file(self, tmp_path):
+        reader = UserspaceLogReader(str(tmp_path / "missing"))
+        assert reader.read_new() == []
+
+    def test_follow(self, tmp_path):
+        log = tmp_path / "tpm2-measure.log"
+        log.write_text(userspace_record(9, DIGEST_AA))
+
+        def append():
+            with open(log, "a") as f:
+                f.write(userspace_record(11, DIGEST_BB))
+
+        timer = threading.Timer(0.1, append)
+        timer.start()
+        try:
+            events = list(UserspaceLogReader(str(log)).follow(
+                timeout=0.5, poll_interval=0.05,
+            ))
+        finally:
+            timer.cancel()
+        assert [e["PCRIndex"] for e in events] == [9, 11]
+
+
+class TestStats:
+    @pytest.fixture
+    def records(self):
+        records = []
+        add_stats_hook(records.append)
+        yield records
+        remove_stats_hook(records.append)
+
+    def test_records_calls(self, records, tmp_path):
+        path = tmp_path / "log.bin"
+        path.write_bytes(binary_log(
+            tcg_event(0, 0x8, b"version"),
+            tcg_event(7, 0x4, b"\0" * 4),
+        ))
+        log = parse_eventlog(str(path))
+        create_refstate(iter(log["events"]), [])
+        replay_pcrs(log["events"])
+        assert [(r["name"], r["events"]) for r in records] == [
+            ("parse_eventlog", 3),
+            ("create_refstate", 3),
+            ("replay_pcrs", 3),
+        ]
+        assert all(r["wall_s"] >= 0 and r["cpu_s"] >= 0 for r in records)
+
+    def test_recorder(self):
+        recorder = StatsRecorder()
+        add_stats_hook(recorder)
+        try:
+            replay_pcrs([make_separator(0)])
+            replay_pcrs([make_separator(0), make_separator(1)])
+        finally:
+            remove_stats_hook(recorder)
+        summary = recorder.summary()
+        assert summary["replay_pcrs"]["calls"] == 2
+        assert summary["replay_pcrs"]["events"] == 3
+
+    def test_no_hooks(self):
+        assert not measured_boot_state._STATS_HOOKS
+        assert replay_pcrs([make_separator(0)])
+
+
+class TestSyntheticLogs:
+    """The benchmark generator must produce logs the parser accepts."""
+
+    def test_write_synthetic_logs(self, tmp_path):
+        from bench_measured_boot_state import write_synthetic_logs
+
+        eventlog, userspace = write_synthetic_logs(
+            str(tmp_path), firmware_blobs=4, dbx_entries=7,
+            ipl_events=3, userspace_extensions=2,
+        )
+        log = parse_eventlog(eventlog, cache_dir="")
+        refstate = create_refstate(
+            log["events"], parse_userspace_log(userspace),
+        )
+        firmware = refstate["scrtm_and_bios"][0]["platform_firmware"]
+        assert len(firmware) == 4
+        assert [len(refstate[k]) for k in ("pk", "kek", "db", "dbx")] \
+            == [1, 2, 3, 7]
+        assert "uki_digest" in refstate
+        assert len(refstate["userspace_digests"]) == 2
+
+
+class FakeTpm(TpmDevice):
+    """Answers TPM2_PCR_Read like a TPM with sha1/sha256 banks."""
+
+    def __init__(self, banks=(0x0004, 0x000B), rc=0):
+        self.path = "fake"
+        self.banks = banks
+        self.rc = rc
+        self.commands = 0
+
+    def value(self, alg_id, pcr):
+        size = 20 if alg_id == 0x0004 else 32
+        return bytes([pcr]) * size
+
+    def transact(self, command):
+        self.commands += 1
+        if self.rc:
+            return struct.pack(">HII", 0x8001, 10, self.rc)
+        (count,) = struct.unpack_from(">I", command, 10)
+        offset = 14
+        sel_out = b""
+        values = []
+        for _ in range(count):
+            alg_id, size = struct.unpack_from(">HB", command, offset)
+            mask = int.from_bytes(command[offset + 3:offset + 6], "little")
+            offset += 3 + size
+            out = 0
+            if alg_id in self.banks:
+                for pcr in range(24):
+                    if mask >> pcr & 1 and len(values) < 8:
+                        out |= 1 << pcr
+                        values.append(self.value(alg_id, pcr))
+            sel_out += struct.pack(">HB", alg_id, 3)
+            sel_out += out.to_bytes(3, "little")
+        body = struct.pack(">II", 1, count) + sel_out
+        body += struct.pack(">I", len(values))
+        body += b"".join(struct.pack(">H", len(v)) + v for v in values)
+        return struct.pack(">HII", 0x8001, 10 + len(body), 0) + body
+
+
+class TestReadTpmPcrs:
+    def test_batched(self):
+        tpm = FakeTpm()
+        banks = read_tpm_pcrs_device(tpm, ("sha1", "sha256"))
+        assert tpm.commands == 6
+        assert sorted(banks["sha256"]) == list(range(24))
+        assert banks["sha256"][5] == "05" * 32
+        assert banks["sha1"][23] == "17" * 20
+
+    def test_unallocated_bank(self):
+        tpm = FakeTpm(banks=(0x000B,))
+        banks = read_tpm_pcrs_device(tpm, ("sha384", "sha256"))
+        assert banks["sha384"] == {}
+        assert len(banks["sha256"]) == 24
+        assert tpm.commands == 3
+
+    def test_subset(self):
+        tpm = FakeTpm()
+        banks = read_tpm_pcrs_device(tpm, ("sha256",), pcrs=[7, 11])
+        assert banks == {"sha256": {7: "07" * 32, 11: "0b" * 32}}
+        assert tpm.commands == 1
+
+    def test_error(self):
+        with pytest.raises(TpmError):
+            read_tpm_pcrs_device(FakeTpm(rc=0x101))
+
+    def test_unknown_bank(self):
+        with pytest.raises(ValueError):
+            read_tpm_pcrs_device(FakeTpm(), ("md5",))
+
+    def test_sysfs_fallback(self, tmp_path):
+        bank = tmp_path / "pcr-sha256"
+        bank.mkdir()
+        (bank / "7").write_text("AB" * 32 + "\n")
+        (bank / "8").write_text("short\n")
+        missing = str(tmp_path / "tpmrm0")
+        assert read_tpm_pcrs(str(bank), device=missing) == {7: "ab" * 32}
+        banks = read_tpm_pcr_banks(
+            ("sha256", "sha1"), device=missing, sysfs_dir=str(tmp_path),
+        )
+        assert banks == {"sha256": {7: "ab" * 32}, "sha1": {}}
+
+    def test_device_failure_falls_back(self, tmp_path, capsys):
+        bank = tmp_path / "pcr-sha256"
+        bank.mkdir()
+        (bank / "0").write_text("00" * 32)
+        # A directory cannot be opened read-write.
+        banks = read_tpm_pcr_banks(
+            ("sha256",), device=str(tmp_path), sysfs_dir=str(tmp_path),
+        )
+        assert banks == {"sha256": {0: "00" * 32}}
+        assert "falling back to sysfs" in capsys.readouterr().err
+
+    def test_explicit_sysfs_not_replaced(self, tmp_path, monkeypatch):
+        bank = tmp_path / "tpm1" / "pcr-sha256"
+        bank.mkdir(parents=True)
+        (bank / "7").write_text("cd" * 32)
+
+        def no_device(path):
+            raise AssertionError(f"opened {path}")
+
+        monkeypatch.setattr(measured_boot_state, "TpmDevice", no_device)
+        assert read_tpm_pcrs(str(bank)) == {7: "cd" * 32}
+
+    @pytest.mark.parametrize("pcrs", [[24], [-1], [7, 1000]])
+    def test_pcr_index_out_of_range(self, pcrs):
+        tpm = FakeTpm()
+        with pytest.raises(ValueError, match="out of range"):
+            read_tpm_pcrs_device(tpm, pcrs=pcrs)
+        assert tpm.commands == 0
+
+    @pytest.mark.skipif(
+        shutil.which("swtpm") is None, reason="swtpm not installed",
+    )
+    def test_swtpm(self, tmp_path):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        proc = subprocess.Popen([
+            "swtpm", "socket", "--tpm2",
+            "--tpmstate", f"dir={tmp_path}",
+            "--server", f"type=tcp,port={port}",
+            "--ctrl", f"type=tcp,port={port + 1}",
+            "--flags", "not-need-init,startup-clear",
+        ])
+        try:
+            for _ in range(50):
+                try:
+                    tpm = TpmDevice(f"tcp://127.0.0.1:{port}")
+                    break
+                except OSError:
+                    time.sleep(0.1)
+            else:
+                pytest.fail("swtpm did not start")
+            with tpm:
+                banks = read_tpm_pcrs_device(tpm, ("sha256",))
+        finally:
+            proc.terminate()
+            proc.wait()
+        assert sorted(banks["sha256"]) == list(range(24))
+        assert banks["sha256"][0] == "00" * 32
+
+
+class TestAsync:
+    @pytest.fixture
+    def logs(self, tmp_path):
+        eventlog = tmp_path / "binary_bios_measurements"
+        eventlog.write_bytes(
+            spec_id_event()
+            + tcg_event(0, 0x08, "1.0".encode("utf-16-le"))
+            + tcg_event(11, 0x0D, b"a")
+        )
+        userspace = tmp_path / "tpm2-measure.log"
+        userspace.write_text("\x1e" + json.dumps({
+            "pcr": 11,
+            "digests": [{"hashAlg": "sha256", "digest": DIGEST_AA}],
+        }) + "\n")
+        return str(eventlog), str(userspace)
+
+    def test_parse_eventlog(self, logs):
+        log = asyncio.run(parse_eventlog_async(logs[0], cache_dir=""))
+        expected = parse_eventlog(logs[0], cache_dir="")
+        assert [dict(e) for e in log["events"]] == [
+            dict(e) for e in expected["events"]
+        ]
+
+    def test_parse_eventlog_cached(self, logs, tmp_path):
+        cache = str(tmp_path / "cache")
+        first = asyncio.run(parse_eventlog_async(logs[0], cache_dir=cache))
+        second = asyncio.run(parse_eventlog_async(logs[0], cache_dir=cache))
+        assert len(os.listdir(cache)) == 1
+        assert second == first
+
+    def test_tpm2_eventlog_backend(self, tmp_path, monkeypatch):
+        tool = tmp_path / "bin" / "tpm2_eventlog"
+        tool.parent.mkdir()
+        tool.write_text(
+            "#!/bin/sh\necho 'version: 1'\n"
+            "echo 'events: [{PCRIndex: 4}]'\n"
+        )
+        tool.chmod(0o755)
+        monkeypatch.setenv("PATH", str(tool.parent))
+        log = asyncio.run(parse_eventlog_async(
+            "unused", backend="tpm2_eventlog", cache_dir="",
+        ))
+        assert log == {"version": 1, "events": [{"PCRIndex": 4}]}
+
+    def test_tpm2_eventlog_missing(self, monkeypatch, capsys):
+        monkeypatch.setenv("PATH", "/nonexistent")
+        log = asyncio.run(parse_eventlog_async(
+            "unused", backend="tpm2_eventlog", cache_dir="",
+        ))
+        assert log is None
+        assert "tpm2_eventlog" in capsys.readouterr().err
+
+    def test_unknown_backend(self):
+        assert asyncio.run(parse_eventlog_async("x", backend="no")) is None
+
+    def test_create_refstate_concurrently(self, logs):
+        expected = create_refstate(
+            parse_eventlog(logs[0], cache_dir="")["events"],
+            parse_userspace_log(logs[1]),
+        )
+
+        async def many():
+            return await asyncio.gather(*(
+                create_refstate_async(logs[0], logs[1], cache_dir="")
+                for _ in range(20)
+            ))
+
+        assert asyncio.run(many()) == [expected] * 20
+
+    def test_userspace_and_pcrs(self, logs, tmp_path):
+        bank = tmp_path / "pcr-sha256"
+        bank.mkdir()
+        (bank / "11").write_text("ab" * 32)
+
+        async def read():
+            return await asyncio.gather(
+                parse_userspace_log_async(logs[1]),
+                read_tpm_pcrs_async(str(bank), device=None),
+            )
+
+        userspace, pcrs = asyncio.run(read())
+        assert userspace == parse_userspace_log(logs[1])
+        assert pcrs == {11: "ab" * 32}
+
+
+class TestDebugBundle:
+    @pytest.fixture
+    def machine(self, tmp_path):
+        eventlog = tmp_path / "binary_bios_measurements"
+        eventlog.write_bytes(
+            spec_id_event()
+            + tcg_event(0, 0x08, "1.0".encode("utf-16-le"))
+            + tcg_event(11, 0x0D, b"a")
+        )
+        userspace = tmp_path / "tpm2-measure.log"
+        userspace.write_text("\x1e" + json.dumps({
+            "pcr": 11,
+            "digests": [{"hashAlg": "sha256", "digest": DIGEST_AA}],
+        }) + "\n")
+        sysfs = tmp_path / "tpm0"
+        for alg, size in (("sha1", 20), ("sha256", 32)):
+            (sysfs / f"pcr-{alg}").mkdir(parents=True)
+            for pcr in (0, 11):
+                (sysfs / f"pcr-{alg}" / str(pcr)).write_text(
+                    f"{pcr:02x}" * size,
+                )
+        saved = tmp_path / "saved-refstate.json"
+        saved.write_text(json.dumps({"pk": []}))
+        return {
+            "eventlog": str(eventlog),
+            "userspace_log": str(userspace),
+            "saved_refstate": str(saved),
+            "device": None,
+            "sysfs_dir": str(sysfs),
+        }
+
+    def test_round_trip(self, machine, tmp_path):
+        bundle = collect_debug_bundle(**machine)
+        path = str(tmp_path / "bundle.json.gz")
+        write_debug_bundle(bundle, path)
+        loaded = read_debug_bundle(path)
+        with open(machine["eventlog"], "rb") as f:
+            assert loaded["eventlog"] == f.read()
+        assert loaded["digest"] == bundle["digest"]
+        assert loaded["userspace_events"] == parse_userspace_log(
+            machine["userspace_log"],
+        )
+        assert loaded["pcrs"]["sha256"] == {0: "00" * 32, 11: "0b" * 32}
+        assert loaded["pcrs"]["sha1"][11] == "0b" * 20
+        assert loaded["pcrs"]["sha384"] == {}
+        assert loaded["saved_refstate"] == {"pk": []}
+        events = list(iter_events(io.BytesIO(loaded["eventlog"])))
+        assert loaded["refstate"] == canonicalize_refstate(
+            create_refstate(events, loaded["userspace_events"]),
+        )
+
+    def test_missing_userspace_log(self, machine, tmp_path):
+        machine["userspace_log"] = str(tmp_path / "missing")
+        machine["saved_refstate"] = None
+        bundle = collect_debug_bundle(**machine)
+        assert bundle["files"]["userspace_log"]["size"] == 0
+        assert bundle["saved_refstate"] is None
+
+    def test_unparseable_inputs(self, machine, tmp_path):
+        eventlog = tmp_path / "binary_bios_measurements"
+        raw = spec_id_event() + tcg_event(0, 0x08, b"1.0")[:-2]
+        eventlog.write_bytes(raw)
+        with open(machine["saved_refstate"], "w") as f:
+            f.write("{truncated")
+        bundle = collect_debug_bundle(**machine)
+        assert bundle["refstate"] is None
+        assert bundle["saved_refstate"] is None
+        assert len(bundle["errors"]) == 2
+        path = str(tmp_path / "bundle.json.gz")
+        write_debug_bundle(bundle, path)
+        loaded = read_debug_bundle(path)
+        assert loaded["eventlog"] == raw
+        assert loaded["errors"] == bundle["errors"]
+
+    def test_tampered(self, machine, tmp_path):
+        bundle = collect_debug_bundle(**machine)
+        bundle["pcrs"]["sha256"]["0"] = "ff" * 32
+        path = str(tmp_path / "bundle.json.gz")
+        write_debug_bundle(bundle, path)
+        with pytest.raises(ValueError, match="digest mismatch"):
+            read_debug_bundle(path)
+
+    def test_tampered_file(self, machine, tmp_path):
+        bundle = collect_debug_bundle(**machine)
+        bundle["files"]["eventlog"]["sha256"] = "00" * 32
+        bundle["digest"] = measured_boot_state._bundle_digest(bundle)
+        path = str(tmp_path / "bundle.json.gz")
+        write_debug_bundle(bundle, path)
+        with pytest.raises(ValueError, match="eventlog digest mismatch"):
+            read_debug_bundle(path)
+
+    def test_not_a_bundle(self, tmp_path):
+        path = tmp_path / "bundle.json.gz"
+        path.write_text("{}")
+        with pytest.raises(ValueError):
+            read_debug_bundle(str(path))
+
+
+class TestImportBudget:
+    """The boot-time reporter imports this module on every boot."""
+
+    # Modules only some code paths need; importing any of them
+    # at module level costs tens of milliseconds of startup.
+    # Checked by name rather than by timing, which would be
+    # flaky on loaded build machines.
+    LAZY = (
+        "asyncio", "concurrent.futures", "sqlite3", "ssl",
+        "subprocess", "tarfile", "urllib.request", "yaml",
+        "difflib", "socket", "gzip",
+    )
+
+    def test_no_heavy_imports(self):
+        env = dict(
+            os.environ,
+            PYTHONPATH=os.path.dirname(measured_boot_state.__file__),
+        )
+        code = (
+            "import sys, measured_boot_state;"
+            " print(' '.join(sorted(sys.modules)))"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            env=env, capture_output=True, text=True, check=True,
+        )
+        assert not set(result.stdout.split()) & set(self.LAZY)
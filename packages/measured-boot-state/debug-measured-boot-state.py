@@ -19,25 +19,57 @@ Usage:
     # Diagnose with explicit event log (offline)
     debug-measured-boot-state diagnose -e log.bin -r enrolled.json
 
+    # Snapshot logs, PCRs and refstates into one bundle, then
+    # diagnose it anywhere
+    debug-measured-boot-state collect -o bundle.json.gz
+    debug-measured-boot-state diagnose --bundle bundle.json.gz
+
     # Diff two refstate files (no live system needed)
     debug-measured-boot-state diagnose old.json new.json
+
+    # Follow runtime PCR extensions (e.g. PCR 9/11) live
+    debug-measured-boot-state watch
+
+    # Fleet index: load saved refstates (<uuid>.json) or
+    # measure-boot-state --batch output, then query it
+    debug-measured-boot-state index fleet.sqlite add refstates/*.json
+    debug-measured-boot-state index fleet.sqlite with 0x1234...
+    debug-measured-boot-state index fleet.sqlite without 0x1234... -k dbx
+    debug-measured-boot-state index fleet.sqlite variants -k dbx
 """
 
 import argparse
+import io
 import json
 import sys
+import time
 from pathlib import Path
+from typing import Any, Dict, Iterator, Tuple
 
 from measured_boot_state import (
+    INDEX_KINDS,
+    PCR_BANK_HASHES,
+    PcrBank,
+    RefstateIndex,
     UEFI_EVENTLOG,
-    TPM_SYSFS,
+    TPM_DEVICE,
+    TPM_SYSFS_DIR,
     USERSPACE_TPM_LOG,
+    UserspaceLogReader,
+    align_sequences,
+    collect_debug_bundle,
     create_refstate,
     diff_refstates,
+    event_to_sha256,
+    find_pcr_divergence,
+    iter_events,
     parse_eventlog,
     parse_userspace_log,
+    read_debug_bundle,
     read_tpm_pcrs,
     replay_pcrs,
+    stats_to_stderr,
+    write_debug_bundle,
 )
 
 # PCRs relevant to the UKI measured boot policy.
@@ -79,10 +111,43 @@ def print_pcr_comparison(
     return all_match
 
 
+def print_pcr_divergence(divergence: dict) -> None:
+    """Explain where each mismatched PCR's replay diverges."""
+    if not divergence:
+        return
+    print("PCR divergence:")
+    for pcr, d in sorted(divergence.items()):
+        if pcr not in POLICY_PCRS:
+            continue
+        verdict = d["verdict"]
+        if verdict == "extra":
+            first = d["first_extra"]
+            print(
+                f"  PCR {pcr:>2}: TPM matches the replay after"
+                f" {d['matched']} of {d['extends']} extension(s);"
+                f" the {first['source']} log has"
+                f" {d['extends'] - d['matched']} more the TPM never saw,"
+                f" from event {first['index']}"
+                + (f" ({first['type']})" if first["type"] else "")
+            )
+        elif verdict == "missing":
+            print(
+                f"  PCR {pcr:>2}: log lacks trailing extension(s)"
+                f" {', '.join(d['missing'])}"
+            )
+        else:
+            print(
+                f"  PCR {pcr:>2}: TPM value matches no prefix of"
+                f" the {d['extends']} logged extension(s);"
+                " an event is corrupted or missing mid-log"
+            )
+
+
 def print_refstate_diff(diff: dict) -> bool:
     """Print a structured refstate diff.
 
-    Returns True if refstates are identical.
+    Returns True if the refstates are equivalent for the
+    policy, i.e. identical up to signature list order.
     """
     print("Refstate diff:")
     all_same = True
@@ -90,6 +155,16 @@ def print_refstate_diff(diff: dict) -> bool:
         if change is None:
             print(f"  {field}: unchanged")
             continue
+        if (
+            field in ("pk", "kek", "db", "dbx")
+            and not change["added"] and not change["removed"]
+        ):
+            print(
+                f"  {field}: reordered"
+                f" ({len(change['moved'])} moved,"
+                " ignored by the policy)"
+            )
+            continue
         all_same = False
         if "old" in change and "new" in change:
             # Digest change
@@ -107,9 +182,21 @@ def print_refstate_diff(diff: dict) -> bool:
                     f" -> {change['new_count']})"
                 )
                 for d in change["removed"]:
-                    print(f"    - {d}")
+                    print(f"    - #{d['index']} {d['sha256']}")
                 for d in change["added"]:
-                    print(f"    + {d}")
+                    print(f"    + #{d['index']} {d['sha256']}")
+                for d in change["moved"]:
+                    print(
+                        f"    ~ #{d['old_index']} -> #{d['new_index']}"
+                        f" {d['sha256']}"
+                    )
+                for d in change["duplicates"]:
+                    print(
+                        f"    * {d['sha256']} measured"
+                        f" {len(d['old_indices'])}"
+                        f" -> {len(d['new_indices'])} times"
+                        f" (at {d['new_indices']})"
+                    )
             else:
                 # Signature list
                 added = change["added"]
@@ -131,16 +218,27 @@ def print_refstate_diff(diff: dict) -> bool:
                     owner = s["SignatureOwner"]
                     data = s["SignatureData"]
                     print(
-                        f"    - Owner={owner}"
+                        f"    - #{s['index']} Owner={owner}"
                         f" Data={data}"
                     )
                 for s in added:
                     owner = s["SignatureOwner"]
                     data = s["SignatureData"]
                     print(
-                        f"    + Owner={owner}"
+                        f"    + #{s['index']} Owner={owner}"
                         f" Data={data}"
                     )
+                for s in change["moved"]:
+                    print(
+                        f"    ~ #{s['old_index']} -> #{s['new_index']}"
+                        f" Data={s['SignatureData']}"
+                    )
+                for s in change["duplicates"]:
+                    print(
+                        f"    * Data={s['SignatureData']}"
+                        f" listed {len(s['old_indices'])}"
+                        f" -> {len(s['new_indices'])} times"
+                    )
     return all_same
 
 
@@ -173,6 +271,21 @@ def print_event_summary(
         r"FvVol\(\w{8}-\w{4}-\w{4}-\w{4}-\w{12}\)"
         r"/FvFile\(\w{8}-\w{4}-\w{4}-\w{4}-\w{12}\)"
     )
+    # Align the log's firmware blobs against the refstate's,
+    # so one inserted or moved blob does not fail every
+    # blob after it.
+    fw_shas = []
+    for event in events:
+        if event.get("EventType", "") in (
+            "EV_EFI_PLATFORM_FIRMWARE_BLOB",
+            "EV_EFI_PLATFORM_FIRMWARE_BLOB2",
+        ):
+            fw_shas.append(event_to_sha256(event).get("sha256", ""))
+    alignment = align_sequences(
+        [d.get("sha256", "") for d in ref_fw], fw_shas,
+    )
+    fw_matched = {j: i for i, j in alignment["matched"]}
+    fw_moved = {j: i for i, j in alignment["moved"]}
     fw_idx = 0
 
     for event in events:
@@ -201,20 +314,21 @@ def print_event_summary(
             "EV_EFI_PLATFORM_FIRMWARE_BLOB",
             "EV_EFI_PLATFORM_FIRMWARE_BLOB2",
         ):
-            expected = ""
-            if fw_idx < len(ref_fw):
-                expected = ref_fw[fw_idx].get(
-                    "sha256", ""
+            if fw_idx in fw_matched:
+                mark = "\u2713"
+            elif fw_idx in fw_moved:
+                mark = (
+                    "\u2717 FAILED (refstate has it at"
+                    f" #{fw_moved[fw_idx]})"
                 )
-            ok = sha == expected
-            mark = "\u2713" if ok else "\u2717 FAILED"
+            else:
+                mark = "\u2717 FAILED (not in refstate)"
             print(
                 f"  PCR {pcr:>2}"
                 f" {et}"
                 f" #{fw_idx}: {mark}"
             )
-            if not ok:
-                print(f"    expected: {expected}")
+            if fw_idx not in fw_matched:
                 print(f"    got:      {sha}")
             fw_idx += 1
 
@@ -279,16 +393,42 @@ def cmd_save(args: argparse.Namespace) -> int:
 
     output = args.output
     with open(output, "w") as f:
-        json.dump(refstate, f, indent=2)
+        json.dump(refstate, f, indent=2, sort_keys=True)
     print(f"Saved refstate to {output}", file=sys.stderr)
     return 0
 
 
+def cmd_collect(args: argparse.Namespace) -> int:
+    """Write a debug bundle for offline diagnosis."""
+    try:
+        bundle = collect_debug_bundle(
+            args.eventlog,
+            args.userspace_log,
+            saved_refstate=DEFAULT_REFSTATE,
+            device=args.tpm_device or None,
+        )
+    except OSError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    for error in bundle["errors"]:
+        print(f"Warning: {error}", file=sys.stderr)
+    output = args.output or (
+        f"measured-boot-{bundle['hostname']}"
+        f"-{bundle['digest'][:16]}.json.gz"
+    )
+    write_debug_bundle(bundle, output)
+    print(f"Wrote debug bundle to {output}", file=sys.stderr)
+    return 0
+
+
 def cmd_diagnose(args: argparse.Namespace) -> int:
     """Diagnose event log against TPM and optionally a refstate.
 
     When two positional refstate files are given, performs a
-    pure offline diff (no event log or TPM needed).
+    pure offline diff (no event log or TPM needed).  With
+    ``--bundle``, the event log, userspace log, PCR values
+    and saved refstate all come from a bundle written by
+    ``collect``.
     """
     # Pure diff mode: two positional refstate files
     if args.refstates and len(args.refstates) == 2:
@@ -317,45 +457,98 @@ def cmd_diagnose(args: argparse.Namespace) -> int:
         )
         return 1
 
-    # Live diagnose mode
-    eventlog_path = args.eventlog
-    if not Path(eventlog_path).exists():
+    if args.bundle:
+        # Offline diagnose of a bundle from 'collect'
+        try:
+            bundle = read_debug_bundle(args.bundle)
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return 1
+        created = time.localtime(bundle["created"])
         print(
-            f"Error: event log not found: {eventlog_path}",
-            file=sys.stderr,
+            f"Bundle {bundle['digest'][:16]} from"
+            f" {bundle['hostname']}, collected"
+            f" {time.strftime('%Y-%m-%d %H:%M:%S %Z', created)}"
         )
-        return 1
+        for error in bundle["errors"]:
+            print(f"Collection error: {error}")
+        # Replay what decodes, so a corrupt log can be triaged.
+        events = []
+        try:
+            for event in iter_events(io.BytesIO(bundle["eventlog"])):
+                events.append(event)
+        except ValueError as e:
+            print(
+                f"Warning: event log malformed after"
+                f" {len(events)} event(s): {e}",
+                file=sys.stderr,
+            )
+        userspace_events = bundle["userspace_events"]
+        userspace_source = "bundle"
+        tpm = bundle["pcrs"].get(args.bank, {})
+        tpm_source = f"bundle {args.bundle} ({args.bank} bank)"
+        saved = bundle["saved_refstate"]
+    else:
+        # Live diagnose mode
+        eventlog_path = args.eventlog
+        if not Path(eventlog_path).exists():
+            print(
+                f"Error: event log not found: {eventlog_path}",
+                file=sys.stderr,
+            )
+            return 1
+
+        log_data = parse_eventlog(eventlog_path)
+        if not log_data:
+            return 1
+        events = log_data.get("events", [])
+
+        # Parse systemd's userspace TPM measurement log
+        userspace_events = parse_userspace_log(
+            args.userspace_log,
+        )
+        userspace_source = args.userspace_log
+        tpm = read_tpm_pcrs(
+            args.tpm_sysfs, device=args.tpm_device or None,
+            algorithm=args.bank,
+        )
+        if args.tpm_sysfs:
+            tpm_source = args.tpm_sysfs
+        else:
+            tpm_source = (
+                f"{args.tpm_device} or {TPM_SYSFS_DIR}/pcr-{args.bank}"
+            )
+        saved = None
+        if Path(DEFAULT_REFSTATE).exists():
+            with open(DEFAULT_REFSTATE) as f:
+                saved = json.load(f)
 
-    log_data = parse_eventlog(eventlog_path)
-    if not log_data:
-        return 1
-    events = log_data.get("events", [])
     if not events:
         print("No events in event log", file=sys.stderr)
         return 1
 
     exit_code = 0
 
-    # Parse systemd's userspace TPM measurement log
-    userspace_events = parse_userspace_log(
-        args.userspace_log,
-    )
     if userspace_events:
         print(
             f"Loaded {len(userspace_events)} userspace"
-            f" TPM event(s) from {args.userspace_log}",
+            f" TPM event(s) from {userspace_source}",
         )
 
     # PCR replay vs TPM
-    replayed = replay_pcrs(events, userspace_events)
-    tpm = read_tpm_pcrs(args.tpm_sysfs)
+    replayed = replay_pcrs(
+        events, userspace_events, algorithm=args.bank,
+    )
     if tpm:
         pcr_ok = print_pcr_comparison(replayed, tpm)
         if not pcr_ok:
             exit_code = 2
+            print_pcr_divergence(find_pcr_divergence(
+                events, userspace_events, tpm, algorithm=args.bank,
+            ))
     else:
         print(
-            f"TPM sysfs not available at {args.tpm_sysfs};"
+            f"TPM not available at {tpm_source};"
             " showing replayed PCRs only:"
         )
         for pcr in POLICY_PCRS:
@@ -363,25 +556,26 @@ def cmd_diagnose(args: argparse.Namespace) -> int:
             print(f"  PCR {pcr:>2}: {val}")
     print()
 
-    # Resolve refstate: explicit flag, auto-detect, or none
-    refstate_path = args.refstate
-    if not refstate_path and Path(DEFAULT_REFSTATE).exists():
-        refstate_path = DEFAULT_REFSTATE
-        print(
-            f"Auto-detected saved refstate:"
-            f" {refstate_path}"
-        )
-
-    if refstate_path:
-        if not Path(refstate_path).exists():
+    # Resolve refstate: explicit flag, saved one, or none
+    enrolled = None
+    if args.refstate:
+        if not Path(args.refstate).exists():
             print(
                 f"Error: refstate not found:"
-                f" {refstate_path}",
+                f" {args.refstate}",
                 file=sys.stderr,
             )
             return 1
-        with open(refstate_path) as f:
+        with open(args.refstate) as f:
             enrolled = json.load(f)
+    elif saved is not None:
+        enrolled = saved
+        print(
+            "Auto-detected saved refstate"
+            + (" in bundle" if args.bundle else f": {DEFAULT_REFSTATE}")
+        )
+
+    if enrolled is not None:
         current = create_refstate(events)
         diff = diff_refstates(enrolled, current)
         ref_ok = print_refstate_diff(diff)
@@ -402,12 +596,99 @@ def cmd_diagnose(args: argparse.Namespace) -> int:
     return exit_code
 
 
+def cmd_watch(args: argparse.Namespace) -> int:
+    """Print PCR values as systemd extends them at runtime."""
+    bank = PcrBank((args.bank,))
+    log_data = parse_eventlog(args.eventlog)
+    if not log_data:
+        return 1
+    bank.update(log_data.get("events", []))
+    print(
+        f"Following {args.userspace_log}"
+        f" ({args.bank} bank, Ctrl-C to stop)",
+        file=sys.stderr,
+    )
+    reader = UserspaceLogReader(args.userspace_log)
+    try:
+        for event in reader.follow():
+            bank.extend_event(event)
+            pcr = event["PCRIndex"]
+            print(
+                f"PCR {pcr:>2}: {bank.value(pcr, args.bank).hex()}",
+                flush=True,
+            )
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def iter_index_inputs(
+    paths: list,
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """``(agent, refstate)`` pairs from refstate files.
+
+    A ``.ndjson`` file holds ``measure-boot-state --batch``
+    records, keyed by their ``uuid`` or else ``source``
+    field; any other file is one refstate named after its
+    agent (``<uuid>.json``).
+    """
+    for path in map(Path, paths):
+        if path.suffix != ".ndjson":
+            with open(path) as f:
+                yield path.stem, json.load(f)
+            continue
+        with open(path) as f:
+            for line in f:
+                record = json.loads(line)
+                if "refstate" in record:
+                    agent = record.get("uuid", record.get("source"))
+                    yield agent, record["refstate"]
+
+
+def cmd_index(args: argparse.Namespace) -> int:
+    """Build or query a fleet index of refstate components."""
+    with RefstateIndex(args.database) as index:
+        if args.action == "add":
+            try:
+                count = index.add_many(iter_index_inputs(args.files))
+            except (OSError, ValueError) as e:
+                print(f"Error: {e}", file=sys.stderr)
+                return 1
+            print(
+                f"Indexed {count} refstate(s) in {args.database}",
+                file=sys.stderr,
+            )
+        elif args.action == "remove":
+            for agent in args.agents:
+                index.remove(agent)
+        elif args.action in ("with", "without"):
+            if args.action == "with":
+                agents = index.agents_with(args.digest, args.kind)
+            else:
+                agents = index.agents_without(args.digest, args.kind)
+            for agent in agents:
+                print(agent)
+            print(f"{len(agents)} agent(s)", file=sys.stderr)
+        elif args.action == "variants":
+            for variant, agents in index.variants(args.kind):
+                print(f"{variant}  {len(agents):>6}  {agents[0]}")
+    return 0
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(
         description=(
             "Debug measured boot policy mismatches"
         ),
     )
+    parser.add_argument(
+        "--stats", action="store_true",
+        help=(
+            "Print timing and event counts of the measured"
+            " boot library as JSON on stderr at exit"
+            " (also MEASURED_BOOT_STATS=1)"
+        ),
+    )
     sub = parser.add_subparsers(dest="command")
 
     # save subcommand
@@ -442,6 +723,46 @@ def main() -> None:
         ),
     )
 
+    # collect subcommand
+    collect = sub.add_parser(
+        "collect",
+        help=(
+            "Bundle the event logs, all PCR banks and the"
+            " refstates for offline diagnosis"
+        ),
+    )
+    collect.add_argument(
+        "-o", "--output",
+        help=(
+            "Output file (default:"
+            " measured-boot-HOST-DIGEST.json.gz)"
+        ),
+    )
+    collect.add_argument(
+        "-e", "--eventlog",
+        default=UEFI_EVENTLOG,
+        help=(
+            "Binary UEFI event log"
+            f" (default: {UEFI_EVENTLOG})"
+        ),
+    )
+    collect.add_argument(
+        "--userspace-log",
+        default=USERSPACE_TPM_LOG,
+        help=(
+            "systemd userspace TPM measurement log"
+            f" (default: {USERSPACE_TPM_LOG})"
+        ),
+    )
+    collect.add_argument(
+        "--tpm-device",
+        default=TPM_DEVICE,
+        help=(
+            "TPM device, or tcp://host:port for swtpm;"
+            f" empty to read sysfs only (default: {TPM_DEVICE})"
+        ),
+    )
+
     # diagnose subcommand (also the default)
     diag = sub.add_parser(
         "diagnose",
@@ -466,10 +787,28 @@ def main() -> None:
             " if not given)"
         ),
     )
+    diag.add_argument(
+        "--bank",
+        choices=sorted(PCR_BANK_HASHES),
+        default="sha256",
+        help="PCR bank to replay and compare (default: sha256)",
+    )
     diag.add_argument(
         "--tpm-sysfs",
-        default=TPM_SYSFS,
-        help=f"TPM PCR sysfs path (default: {TPM_SYSFS})",
+        help=(
+            "TPM PCR sysfs path to read instead of the TPM device"
+            " (default: the device, falling back to"
+            f" {TPM_SYSFS_DIR}/pcr-BANK)"
+        ),
+    )
+    diag.add_argument(
+        "--tpm-device",
+        default=TPM_DEVICE,
+        help=(
+            "TPM device for batched PCR reads, or tcp://host:port"
+            " for swtpm; empty to read sysfs only"
+            f" (default: {TPM_DEVICE})"
+        ),
     )
     diag.add_argument(
         "--userspace-log",
@@ -479,6 +818,13 @@ def main() -> None:
             f" (default: {USERSPACE_TPM_LOG})"
         ),
     )
+    diag.add_argument(
+        "-b", "--bundle",
+        help=(
+            "Diagnose a bundle written by 'collect' instead"
+            " of the live system"
+        ),
+    )
     diag.add_argument(
         "refstates",
         nargs="*",
@@ -489,18 +835,105 @@ def main() -> None:
         ),
     )
 
+    # watch subcommand
+    watch = sub.add_parser(
+        "watch",
+        help=(
+            "Follow the userspace TPM log and print"
+            " replayed PCR values as they are extended"
+        ),
+    )
+    watch.add_argument(
+        "-e", "--eventlog",
+        default=UEFI_EVENTLOG,
+        help=(
+            "Binary UEFI event log"
+            f" (default: {UEFI_EVENTLOG})"
+        ),
+    )
+    watch.add_argument(
+        "--userspace-log",
+        default=USERSPACE_TPM_LOG,
+        help=(
+            "systemd userspace TPM measurement log"
+            f" (default: {USERSPACE_TPM_LOG})"
+        ),
+    )
+    watch.add_argument(
+        "--bank",
+        choices=sorted(PCR_BANK_HASHES),
+        default="sha256",
+        help="PCR bank to replay (default: sha256)",
+    )
+
+    # index subcommand
+    index = sub.add_parser(
+        "index",
+        help=(
+            "Build or query a SQLite index of refstate"
+            " components across a fleet"
+        ),
+    )
+    index.add_argument("database", help="SQLite index file")
+    actions = index.add_subparsers(dest="action", required=True)
+    add = actions.add_parser(
+        "add",
+        help=(
+            "Index refstate files (<uuid>.json) or"
+            " measure-boot-state --batch NDJSON"
+        ),
+    )
+    add.add_argument("files", nargs="+", metavar="FILE")
+    remove = actions.add_parser("remove", help="Drop agents")
+    remove.add_argument("agents", nargs="+", metavar="AGENT")
+    for action, help_text in (
+        ("with", "List agents whose refstate has DIGEST"),
+        ("without", "List agents whose refstate lacks DIGEST"),
+    ):
+        query = actions.add_parser(action, help=help_text)
+        query.add_argument(
+            "digest",
+            help="Component digest or signature data",
+        )
+        query.add_argument(
+            "-k", "--kind", choices=INDEX_KINDS,
+            help="Only match this component kind",
+        )
+    variants = actions.add_parser(
+        "variants",
+        help=(
+            "Group agents by refstate, or by one component"
+            " kind: variant, agent count, example agent"
+        ),
+    )
+    variants.add_argument(
+        "-k", "--kind", choices=INDEX_KINDS,
+        help="Group by this component kind only",
+    )
+
     args = parser.parse_args()
+    if args.stats:
+        stats_to_stderr()
 
     if args.command == "save":
         sys.exit(cmd_save(args))
+    elif args.command == "collect":
+        sys.exit(cmd_collect(args))
     elif args.command == "diagnose":
         sys.exit(cmd_diagnose(args))
+    elif args.command == "watch":
+        sys.exit(cmd_watch(args))
+    elif args.command == "index":
+        sys.exit(cmd_index(args))
     else:
         # Default to diagnose if no subcommand given
         args.eventlog = UEFI_EVENTLOG
         args.refstate = None
         args.refstates = []
-        args.tpm_sysfs = TPM_SYSFS
+        args.bank = "sha256"
+        args.tpm_sysfs = None
+        args.tpm_device = TPM_DEVICE
+        args.bundle = None
         args.userspace_log = USERSPACE_TPM_LOG
         sys.exit(cmd_diagnose(args))
 
@@ -4,10 +4,15 @@
   tpm2-tools,
   writers,
   callPackage,
+  python3,
+  runCommand,
 }:
 let
   measured-boot-library = callPackage ../measured-boot-library { };
   libraries = [ measured-boot-library ];
+  # The event log is parsed in-process by default.  tpm2-tools and
+  # libefivar are kept on the wrapper's search paths for the
+  # MEASURED_BOOT_EVENTLOG_BACKEND=tpm2_eventlog fallback.
   makeWrapperArgs = [
     "--prefix"
     "PATH"
@@ -23,8 +28,39 @@ let
     "${lib.getLib efivar}/lib"
   ];
   scriptArgs = { inherit libraries makeWrapperArgs; };
+
+  # The tool scripts as plain files (still flake8-checked by the
+  # writer), with bytecode compiled so the multi-call entry point
+  # does not recompile them on every start.
+  toolNames = [
+    "measure-boot-state"
+    "report-measured-boot-state"
+    "debug-measured-boot-state"
+  ];
+  tools = runCommand "measured-boot-tools" { nativeBuildInputs = [ python3 ]; } ''
+    mkdir -p $out
+    ${lib.concatMapStrings (name: ''
+      cp ${
+        writers.writePython3 "${name}.py" { inherit libraries; } (builtins.readFile ./${name}.py)
+      } $out/${name}.py
+    '') toolNames}
+    python3 -m compileall -q $out
+  '';
 in
 {
+  # Multi-call entry point: `measured-boot measure|report|debug`.
+  # Loads only the selected tool; used by the boot-time reporter.
+  measured-boot = writers.writePython3Bin "measured-boot" (
+    scriptArgs
+    // {
+      makeWrapperArgs = makeWrapperArgs ++ [
+        "--set"
+        "MEASURED_BOOT_TOOLS"
+        "${tools}"
+      ];
+    }
+  ) (builtins.readFile ./measured-boot.py);
+
   # CLI tool to generate the measured boot reference state from an
   # event log.  Thin wrapper around the measured_boot_state library.
   measure-boot-state = writers.writePython3Bin "measure-boot-state" scriptArgs (
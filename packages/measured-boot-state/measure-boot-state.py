@@ -7,21 +7,172 @@ Usage::
     measure-boot-state \\
         -e /sys/kernel/security/tpm0/binary_bios_measurements \\
         -o refstate.json
+
+    # One NDJSON line per captured log in a directory or
+    # tarball, generated in parallel
+    measure-boot-state --batch fleet-logs.tar.gz -o out.ndjson
+
+    # Expected PCR 11 of a UKI, once booted, without a machine
+    measure-boot-state --predict-pcr11 nixos.efi --pcrphase
 """
 
 import argparse
+import contextlib
+import io
 import json
+import os
 import sys
-from typing import Any, Dict, Optional
+from collections import Counter, deque
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING, Any, Deque, Dict, Iterator, Optional, TextIO, Tuple,
+)
 
 from measured_boot_state import (
+    PCR_BANK_HASHES,
+    PCRPHASE_BOOTED,
     UEFI_EVENTLOG,
     USERSPACE_TPM_LOG,
     create_refstate,
     parse_eventlog,
     parse_userspace_log,
+    predict_pcr11,
+    refstate_digest,
+    refstate_from_bytes,
+    stats_to_stderr,
 )
 
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+
+# A log read from the batch source: (name, data, read error).
+BatchItem = Tuple[str, Optional[bytes], Optional[str]]
+
+
+def iter_batch_logs(source: str) -> Iterator[BatchItem]:
+    """Event logs from a directory tree or a tarball.
+
+    Files are yielded in sorted order (directories) or archive
+    order (tarballs); unreadable entries carry an error
+    instead of data.
+    """
+    path = Path(source)
+    if path.is_dir():
+        for entry in sorted(path.rglob("*")):
+            if not entry.is_file():
+                continue
+            name = str(entry.relative_to(path))
+            try:
+                yield name, entry.read_bytes(), None
+            except OSError as e:
+                yield name, None, str(e)
+        return
+    import tarfile
+
+    with tarfile.open(source, "r:*") as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            try:
+                f = tar.extractfile(member)
+                data = f.read() if f is not None else None
+            except (OSError, tarfile.TarError) as e:
+                yield member.name, None, str(e)
+                continue
+            yield member.name, data, None
+
+
+def batch_worker(name: str, data: bytes) -> Dict[str, Any]:
+    """Process-pool task: one log to one NDJSON record."""
+    warnings = io.StringIO()
+    try:
+        with contextlib.redirect_stderr(warnings):
+            refstate = refstate_from_bytes(data)
+    except ValueError as e:
+        return {"source": name, "error": str(e)}
+    record: Dict[str, Any] = {
+        "source": name,
+        "refstate_sha256": refstate_digest(refstate),
+        "refstate": refstate,
+    }
+    if warnings.getvalue():
+        record["warnings"] = warnings.getvalue().splitlines()
+    return record
+
+
+def run_batch(
+    source: str, out: TextIO, jobs: Optional[int],
+) -> Optional[Dict[str, Any]]:
+    """Write one NDJSON record per log in *source* to *out*.
+
+    Logs are processed in a process pool, but records are
+    written in input order as soon as they are ready.  At
+    most a few logs per worker are held in memory at once.
+    A log that fails to parse yields an ``error`` record and
+    does not affect the others.
+
+    Returns a summary, or None if any log failed.
+    """
+    import tarfile
+    from concurrent.futures import ProcessPoolExecutor
+
+    distinct: Counter = Counter()
+    failed = 0
+    window = 4 * (jobs or os.cpu_count() or 1)
+    pending: Deque[Tuple[str, "Future"]] = deque()
+
+    def emit(name: str, future: "Future") -> None:
+        nonlocal failed
+        try:
+            record = future.result()
+        except Exception as e:
+            record = {"source": name, "error": str(e)}
+        if "error" in record:
+            failed += 1
+        else:
+            distinct[record["refstate_sha256"]] += 1
+        out.write(json.dumps(record) + "\n")
+        out.flush()
+
+    try:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            for name, data, error in iter_batch_logs(source):
+                if data is None:
+                    failed += 1
+                    out.write(json.dumps({
+                        "source": name,
+                        "error": error or "not a regular file",
+                    }) + "\n")
+                    continue
+                pending.append(
+                    (name, pool.submit(batch_worker, name, data)),
+                )
+                while len(pending) >= window:
+                    emit(*pending.popleft())
+            while pending:
+                emit(*pending.popleft())
+    except (OSError, tarfile.TarError) as e:
+        print(
+            f"Error: cannot read batch source {source}: {e}",
+            file=sys.stderr,
+        )
+        return None
+
+    total = failed + sum(distinct.values())
+    print(
+        f"Processed {total} event log(s): {failed} failed,"
+        f" {len(distinct)} distinct refstate(s)",
+        file=sys.stderr,
+    )
+    for digest, count in distinct.most_common():
+        print(f"  {digest}  {count} log(s)", file=sys.stderr)
+    summary = {
+        "logs": total,
+        "failed": failed,
+        "refstates": dict(distinct),
+    }
+    return summary if not failed and total else None
+
 
 def main() -> Optional[Dict[str, Any]]:
     parser = argparse.ArgumentParser(
@@ -49,7 +200,69 @@ def main() -> Optional[Dict[str, Any]]:
             f" (default: {USERSPACE_TPM_LOG})"
         ),
     )
+    parser.add_argument(
+        "--batch",
+        metavar="SOURCE",
+        help=(
+            "Directory or tarball of captured event logs;"
+            " writes one NDJSON record per log to --output"
+            " (ignores --eventlog and --userspace-log)"
+        ),
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int,
+        help="Worker processes for --batch (default: CPUs)",
+    )
+    parser.add_argument(
+        "--predict-pcr11",
+        metavar="UKI",
+        help=(
+            "Print the PCR 11 values the UKI will produce,"
+            " per bank, instead of reading an event log"
+        ),
+    )
+    parser.add_argument(
+        "--pcrphase", action="store_true",
+        help=(
+            "With --predict-pcr11, include the systemd-pcrphase"
+            " extensions of a booted system"
+            f" ({', '.join(PCRPHASE_BOOTED)})"
+        ),
+    )
+    parser.add_argument(
+        "--stats", action="store_true",
+        help=(
+            "Print timing and event counts of the measured"
+            " boot library as JSON on stderr at exit"
+            " (also MEASURED_BOOT_STATS=1)"
+        ),
+    )
     args = parser.parse_args()
+    if args.stats:
+        stats_to_stderr()
+
+    if args.predict_pcr11:
+        try:
+            predicted = predict_pcr11(
+                args.predict_pcr11,
+                PCRPHASE_BOOTED if args.pcrphase else (),
+                PCR_BANK_HASHES,
+            )
+        except (OSError, ValueError) as e:
+            print(
+                f"Error: cannot read UKI {args.predict_pcr11}: {e}",
+                file=sys.stderr,
+            )
+            return None
+        json.dump({"pcr11": predicted}, sys.stdout, sort_keys=True)
+        print()
+        return predicted
+
+    if args.batch:
+        if args.output == "-":
+            return run_batch(args.batch, sys.stdout, args.jobs)
+        with open(args.output, "w") as out:
+            return run_batch(args.batch, out, args.jobs)
 
     log_data = parse_eventlog(args.eventlog)
     if not log_data:
@@ -67,10 +280,10 @@ def main() -> Optional[Dict[str, Any]]:
     refstate = create_refstate(events, userspace_events)
 
     if args.output == "-":
-        json.dump(refstate, sys.stdout)
+        json.dump(refstate, sys.stdout, sort_keys=True)
     else:
         with open(args.output, "w") as f:
-            json.dump(refstate, f)
+            json.dump(refstate, f, sort_keys=True)
 
     return refstate
 
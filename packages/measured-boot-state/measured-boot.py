@@ -0,0 +1,66 @@
+"""Multi-call entry point for the measured boot tools.
+
+Usage:
+
+    measured-boot measure [ARGS...]   # measure-boot-state
+    measured-boot report [ARGS...]    # report-measured-boot-state
+    measured-boot debug [ARGS...]     # debug-measured-boot-state
+
+The full tool names are accepted as well.  Only the selected
+tool's source is loaded, and the tools and the
+``measured_boot_state`` library import heavy modules (ssl,
+urllib, tarfile, asyncio, sqlite3, ...) only on the code paths
+that need them, so startup stays cheap on the boot path.
+
+Tools are looked up in ``$MEASURED_BOOT_TOOLS`` (set by the
+package), or next to this file in a source checkout.
+"""
+
+import os
+import sys
+
+TOOLS = {
+    "measure": "measure-boot-state",
+    "report": "report-measured-boot-state",
+    "debug": "debug-measured-boot-state",
+}
+
+
+def usage() -> str:
+    names = ", ".join(
+        f"{short} ({tool})" for short, tool in TOOLS.items()
+    )
+    return f"usage: measured-boot TOOL [ARGS...]\ntools: {names}"
+
+
+def main() -> None:
+    if len(sys.argv) < 2 or sys.argv[1] in ("-h", "--help"):
+        print(usage(), file=sys.stderr)
+        sys.exit(0 if len(sys.argv) >= 2 else 2)
+    name = sys.argv[1]
+    tool = TOOLS.get(name, name)
+    if tool not in TOOLS.values():
+        print(f"unknown tool {name!r}\n{usage()}", file=sys.stderr)
+        sys.exit(2)
+    tools_dir = os.environ.get(
+        "MEASURED_BOOT_TOOLS",
+        os.path.dirname(os.path.abspath(__file__)),
+    )
+    # Unlike runpy.run_path, the import system reuses compiled
+    # bytecode from __pycache__ (precompiled by the package).
+    import importlib.util
+
+    spec = importlib.util.spec_from_file_location(
+        "__main__", os.path.join(tools_dir, f"{tool}.py"),
+    )
+    assert spec is not None and spec.loader is not None
+    module = importlib.util.module_from_spec(spec)
+    # The tool is __main__, so that process pool workers in
+    # measure-boot-state --batch can find its functions.
+    sys.modules["__main__"] = module
+    sys.argv = [tool] + sys.argv[2:]
+    spec.loader.exec_module(module)
+
+
+if __name__ == "__main__":
+    main()
@@ -19,19 +19,22 @@ import json
 import os
 import sys
 import time
-import urllib.request
-import urllib.error
-import ssl
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 from measured_boot_state import (
     UEFI_EVENTLOG,
     USERSPACE_TPM_LOG,
+    compact_refstate,
     create_refstate,
     parse_eventlog,
     parse_userspace_log,
+    stats_to_stderr,
 )
 
+if TYPE_CHECKING:
+    import ssl
+
 ATTESTATION_SERVER = Path("/boot/attestation-server.json")
 AGENT_DATA = Path("/var/lib/keylime/agent_data.json")
 GIT_CERT_DIR = Path("/run/keylime-git")
@@ -79,6 +82,72 @@ def generate_measured_boot_state(
     return create_refstate(events, userspace_events)
 
 
+def post_json(
+    endpoint: str, payload: dict, ctx: "ssl.SSLContext",
+) -> dict:
+    """POST *payload* as JSON and return the decoded reply."""
+    import urllib.request
+
+    req = urllib.request.Request(
+        endpoint,
+        data=json.dumps(payload).encode(),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    with urllib.request.urlopen(req, context=ctx) as resp:
+        return json.loads(resp.read())
+
+
+def send_report(
+    endpoint: str,
+    uuid: str,
+    measured_boot_state: dict,
+    ctx: "ssl.SSLContext",
+) -> dict:
+    """Send the refstate in compact form, full as a fallback.
+
+    The Secure Boot signature lists are sent by reference;
+    the server asks for any it does not have yet, so the
+    large dbx list is only transferred once per fleet.
+    Servers that predate compact reports reject them with
+    400, in which case the full refstate is sent; so does a
+    server error (5xx) while handling the compact report.
+    """
+    import urllib.error
+
+    sets: dict = {}
+    payload = {
+        "uuid": uuid,
+        "measured_boot_state_compact": compact_refstate(
+            measured_boot_state, sets,
+        ),
+    }
+    try:
+        body = post_json(endpoint, payload, ctx)
+    except urllib.error.HTTPError as e:
+        if e.code != 400 and e.code < 500:
+            raise
+        print(
+            f"Compact report failed ({e.code});"
+            " sending the full refstate",
+            file=sys.stderr,
+        )
+        return post_json(endpoint, {
+            "uuid": uuid,
+            "measured_boot_state": measured_boot_state,
+        }, ctx)
+    if body.get("status") != "need_signature_sets":
+        return body
+    missing = [d for d in body.get("missing", []) if d in sets]
+    print(
+        f"Uploading {len(missing)} signature set(s)"
+        " unknown to the server",
+        file=sys.stderr,
+    )
+    payload["signature_sets"] = {d: sets[d] for d in missing}
+    return post_json(endpoint, payload, ctx)
+
+
 def get_agent_uuid(timeout: int = 60) -> str:
     """Read the agent UUID from agent_data.json."""
     env_uuid = os.environ.get("KEYLIME_AGENT_UUID")
@@ -173,7 +242,17 @@ def main() -> None:
             f" (default: {USERSPACE_TPM_LOG})"
         ),
     )
+    parser.add_argument(
+        "--stats", action="store_true",
+        help=(
+            "Print timing and event counts of the measured"
+            " boot library as JSON on stderr at exit"
+            " (also MEASURED_BOOT_STATS=1)"
+        ),
+    )
     args = parser.parse_args()
+    if args.stats:
+        stats_to_stderr()
 
     measured_boot_state = generate_measured_boot_state(
         args.eventlog, args.userspace_log,
@@ -198,26 +277,20 @@ def main() -> None:
     )
     print(f"Enrollment server: {url}", file=sys.stderr)
 
-    endpoint = f"{url}/v1/report_measured_boot_state"
-    payload = json.dumps({
-        "uuid": uuid,
-        "measured_boot_state": measured_boot_state,
-    }).encode()
+    # Network modules are imported only now.  Every report
+    # pays for them (ssl alone costs tens of milliseconds), but
+    # runs that fail before reaching the server do not.
+    import ssl
+    import urllib.error
+    import urllib.request
 
+    endpoint = f"{url}/v1/report_measured_boot_state"
     ctx = ssl.create_default_context(cadata=ca_cert)
 
-    req = urllib.request.Request(
-        endpoint,
-        data=payload,
-        headers={"Content-Type": "application/json"},
-        method="POST",
-    )
-
     try:
-        with urllib.request.urlopen(
-            req, context=ctx,
-        ) as resp:
-            body = json.loads(resp.read())
+        body = send_report(
+            endpoint, uuid, measured_boot_state, ctx,
+        )
     except urllib.error.URLError as e:
         print(
             f"Error: POST to {endpoint} failed: {e}",